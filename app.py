@@ -1,25 +1,659 @@
+import io
 import os
-import shutil
+import json
+import time
+import asyncio
+import unicodedata
 import hashlib
+import zipfile
 import uvicorn
 import logging
 import traceback
-import librosa
-import edge_tts
-import soundfile as sf
-from fastapi import FastAPI, UploadFile, HTTPException, File, Form
-from fastapi.responses import FileResponse
+from contextlib import asynccontextmanager, nullcontext
+from functools import partial
+from fastapi import (
+    FastAPI,
+    UploadFile,
+    HTTPException,
+    File,
+    Form,
+    Query,
+    Request,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from typing import List, Optional
 
 from src.rmvpe import RMVPE
-from model_loader import ModelLoader
+from src.audio_io import (
+    load_audio,
+    load_raw,
+    encode_wav,
+    encode_audio,
+    transcode_wav,
+    OUTPUT_FORMATS,
+    AVAILABLE_FORMATS,
+    fetch_tts_audio,
+    crossfade_concat,
+    streaming_wav_header,
+)
+from src.executor import InferenceExecutor
+from src.batcher import MicroBatcher
+from src.jobs import JobManager
+from src.cache import AudioCache
+from src.tts_cache import TTSAudioCache
+from src.realtime import RealtimeSession
+from src.singleflight import SingleFlight
+from src.admission import AdmissionController, Overloaded
+from src.cancel import CancelToken, Cancelled
+from src.text_splitter import split_sentences
+from src.metrics import (
+    REGISTRY,
+    STAGE_SECONDS,
+    REQUESTS_IN_FLIGHT,
+    REQUEST_SECONDS,
+    ADMISSION_GAUGE,
+    CANCELLED_REQUESTS,
+    ENCODE_SECONDS,
+    PROCESS_RSS,
+    PROCESS_MEMORY,
+    EXECUTOR_GAUGE,
+    MODEL_POOL_GAUGE,
+    process_rss,
+    process_memory,
+)
+from model_loader import ModelLoader, ModelHandle
+from model_pool import ModelPool, Preloader
+from model_registry import ModelRegistry
 
 logger = logging.getLogger(__name__)
 
+if len(AVAILABLE_FORMATS) < len(OUTPUT_FORMATS):
+    logger.warning(
+        "libsndfile cannot write "
+        + ", ".join(f for f in OUTPUT_FORMATS if f not in AVAILABLE_FORMATS)
+        + ", those output formats are disabled"
+    )
+
 app = FastAPI()
 model_loader = ModelLoader()
 gpu_config = model_loader.config
 hubert_model = model_loader.load_hubert()
 rmvpe_model = RMVPE("rmvpe.pt", gpu_config.is_half, gpu_config.device)
+model_pool = ModelPool(model_loader, gpu_config.model_pool_budget)
+model_registry = ModelRegistry(model_loader.model_root)
+
+
+def _preload_list(preload):
+    if preload.strip() == "all":
+        return model_loader.model_list
+    return [name.strip() for name in preload.split(",") if name.strip()]
+
+
+preload_models = _preload_list(gpu_config.preload_models)
+
+
+def _use_if_idle(handle):
+    # the first listed preload model serves requests that do not name one,
+    # whichever preload happens to finish first
+    if preload_models and handle.model_name == preload_models[0]:
+        model_loader.use_default(handle)
+
+
+preloader = Preloader(
+    model_pool,
+    preload_models,
+    gpu_config.preload_workers,
+    on_loaded=_use_if_idle,
+)
+tts_cache = AudioCache(
+    gpu_config.cache_root,
+    gpu_config.cache_max_bytes,
+    gpu_config.cache_max_entries,
+    "tts",
+)
+tts_audio_cache = TTSAudioCache(
+    AudioCache(
+        gpu_config.tts_cache_root,
+        gpu_config.tts_cache_max_bytes,
+        gpu_config.cache_max_entries,
+        "edge_tts",
+    ),
+    gpu_config.tts_cache_memory_bytes,
+)
+sentence_cache = AudioCache(
+    gpu_config.sentence_cache_root,
+    gpu_config.sentence_cache_max_bytes,
+    gpu_config.cache_max_entries,
+    "sentence",
+)
+tts_flight = SingleFlight("tts")
+admission = AdmissionController(
+    gpu_config.admission_budget,
+    gpu_config.infer_workers,
+    gpu_config.admission_rtf,
+    gpu_config.admission_seconds_per_char,
+)
+executor = InferenceExecutor(gpu_config.infer_workers, gpu_config.infer_threads)
+batcher = (
+    MicroBatcher(
+        gpu_config.batch_max_size,
+        gpu_config.batch_max_wait,
+        gpu_config.batch_max_seconds * 16000,
+        gpu_config.batch_bucket_ms * 16,
+        gpu_config.infer_threads,
+    )
+    if gpu_config.batch_max_size > 1
+    else None
+)
+
+
+@app.on_event("startup")
+async def start_jobs():
+    job_manager.start()
+
+
+@app.on_event("startup")
+async def start_preload():
+    preloader.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_executor():
+    preloader.shutdown()
+    await job_manager.stop()
+    executor.shutdown()
+
+
+# per-endpoint in-flight and latency metrics, other routes are not tracked
+_TRACKED_PATHS = {
+    "/tts",
+    "/tts/stream",
+    "/tts/batch",
+    "/rvc",
+    "/rvc/raw",
+    "/jobs",
+}
+
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    if request.url.path not in _TRACKED_PATHS:
+        return await call_next(request)
+
+    endpoint = request.url.path.lstrip("/")
+
+    REQUESTS_IN_FLIGHT.inc(endpoint=endpoint)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start, endpoint=endpoint, status=status
+        )
+        REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+
+
+def _labels(handle, f0_method, endpoint):
+    return {"model": handle.model_name, "f0_method": f0_method, "endpoint": endpoint}
+
+
+def _observe_times(times, labels):
+    for stage, seconds in zip(("hubert", "f0", "synth"), times):
+        STAGE_SECONDS.observe(seconds, stage=stage, **labels)
+
+
+def _observe_stream(segments, times, labels):
+    yield from segments
+    _observe_times(times, labels)
+
+
+async def _decode(data, labels, suffix=".mp3"):
+    timings = {}
+    audio = await run_in_threadpool(
+        load_audio,
+        data,
+        gpu_config.spill_threshold,
+        suffix=suffix,
+        timings=timings,
+    )
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage, **labels)
+    return audio
+
+
+async def _decode_raw(data, labels, sample_rate, dtype, channels):
+    timings = {}
+    try:
+        audio = await run_in_threadpool(
+            load_raw, data, sample_rate, dtype, channels, timings=timings
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage, **labels)
+    return audio
+
+
+def _encode(audio_opt, sr, labels, fmt="wav"):
+    with STAGE_SECONDS.time(stage="encode", **labels), ENCODE_SECONDS.time(
+        format=fmt, endpoint=labels["endpoint"]
+    ):
+        if fmt == "wav":
+            return encode_wav(audio_opt, sr)
+        return encode_audio(audio_opt, sr, fmt)
+
+
+def _transcode(wav, fmt, labels):
+    with ENCODE_SECONDS.time(format=fmt, endpoint=labels["endpoint"]):
+        return transcode_wav(wav, fmt)
+
+
+_ACCEPT_FORMATS = {
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/wave": "wav",
+    "audio/flac": "flac",
+    "audio/x-flac": "flac",
+    "audio/ogg": "ogg",
+    "audio/opus": "opus",
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+}
+
+
+def _output_format(fmt, accept):
+    # an explicit format field wins, then the first audio type in Accept
+    if fmt:
+        fmt = fmt.lower()
+        if fmt not in AVAILABLE_FORMATS:
+            info = f"Format should be one of {', '.join(AVAILABLE_FORMATS)}, but got {fmt}."
+            raise HTTPException(status_code=400, detail=info)
+        return fmt
+    for part in (accept or "").lower().split(","):
+        media_type = part.split(";")[0].strip()
+        if media_type == "audio/ogg" and "codecs=opus" in part:
+            media_type = "audio/opus"
+        # types this libsndfile cannot write are skipped like unknown ones
+        if _ACCEPT_FORMATS.get(media_type) in AVAILABLE_FORMATS:
+            return _ACCEPT_FORMATS[media_type]
+    return "wav"
+
+
+def _audio_response(content, name, fmt="wav"):
+    return Response(
+        content=content,
+        media_type=OUTPUT_FORMATS[fmt][0],
+        headers={"Content-Disposition": f"attachment; filename={name}.{fmt}"},
+    )
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    candidates = [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
+    return "*" in candidates or etag in candidates
+
+
+def _parse_range(range_header, size):
+    # a single "bytes=" range as (start, end) inclusive, None serves it all
+    if not range_header:
+        return None
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start, end = max(0, size - int(last)), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable.",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(length)
+
+
+async def _cached_audio_response(
+    request, etag, name, fmt="wav", content=None, path=None, headers=None
+):
+    # the ETag is a digest of the bytes served, strong whatever produced them,
+    # and results are immutable under their cache key so proxies may keep them
+    cache_headers = {
+        "ETag": f'"{etag}"',
+        "Cache-Control": f"public, max-age={gpu_config.cache_max_age}",
+        "Vary": "Accept",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), cache_headers["ETag"]):
+        return Response(status_code=304, headers=cache_headers)
+
+    headers = {
+        **cache_headers,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename={name}.{fmt}",
+        **(headers or {}),
+    }
+    media_type = OUTPUT_FORMATS[fmt][0]
+    size = len(content) if content is not None else os.path.getsize(path)
+    byte_range = _parse_range(request.headers.get("range"), size)
+    if byte_range is None:
+        if content is None:
+            return FileResponse(path, media_type=media_type, headers=headers)
+        return Response(content=content, media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    if content is None:
+        content = await run_in_threadpool(_read_range, path, start, end - start + 1)
+    else:
+        content = content[start : end + 1]
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(
+        content=content, status_code=206, media_type=media_type, headers=headers
+    )
+
+
+def _output_sr(handle, resample_sr):
+    if handle.tgt_sr != resample_sr >= 16000:
+        return resample_sr
+    return handle.tgt_sr
+
+
+def _cost(handle, f0_method, index_rate, duration=None, text=None):
+    use_index = handle.index is not None and index_rate > 0
+    if text is not None:
+        return admission.estimate_text(text, f0_method, use_index)
+    return admission.estimate(duration, f0_method, use_index)
+
+
+def _admit(handle, endpoint, f0_method, index_rate, duration=None, text=None):
+    return _admit_cost(
+        _cost(handle, f0_method, index_rate, duration=duration, text=text), endpoint
+    )
+
+
+def _admit_cost(cost, endpoint):
+    try:
+        return admission.admit(cost, endpoint)
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
+async def _watch_disconnect(request, token):
+    while token.reason is None:
+        if await request.is_disconnected():
+            token.cancel("disconnected")
+            return
+        await asyncio.sleep(0.5)
+
+
+@asynccontextmanager
+async def _cancellation(request, endpoint):
+    # the pipeline polls the token, so a client that went away or a request
+    # past its deadline stops at the next stage or segment
+    token = CancelToken(gpu_config.request_deadline)
+    watcher = asyncio.ensure_future(_watch_disconnect(request, token))
+    try:
+        yield token
+    except Cancelled as e:
+        CANCELLED_REQUESTS.inc(endpoint=endpoint, reason=e.reason)
+        status_code = 504 if e.reason == "deadline" else 499
+        raise HTTPException(status_code=status_code, detail=str(e))
+    finally:
+        watcher.cancel()
+
+
+def _convert(
+    handle,
+    audio,
+    f0_up_key,
+    f0_method,
+    index_rate,
+    protect,
+    filter_radius,
+    resample_sr,
+    rms_mix_rate,
+    stream=False,
+    progress=None,
+    labels=None,
+    cancel=None,
+    limiter=None,
+):
+    tgt_sr, net_g, vc, version, index_file, if_f0 = (
+        handle.tgt_sr,
+        handle.net_g,
+        handle.vc,
+        handle.version,
+        handle.index_file,
+        handle.if_f0,
+    )
+    if f0_method == "rmvpe":
+        vc.model_rmvpe = rmvpe_model
+
+    # only used as the harvest f0 cache key, so key it by content
+    input_audio_path = hashlib.md5(audio.tobytes()).hexdigest()
+
+    times = [0, 0, 0]
+    pipeline = vc.pipeline
+    if stream:
+        pipeline = partial(vc.pipeline_stream, limiter=limiter)
+    audio_opt = pipeline(
+        hubert_model,
+        net_g,
+        0,
+        audio,
+        input_audio_path,
+        times,
+        int(f0_up_key),
+        f0_method,
+        index_file,
+        index_rate,
+        if_f0,
+        filter_radius,
+        tgt_sr,
+        resample_sr,
+        rms_mix_rate,
+        version,
+        protect,
+        None,
+        batcher=batcher,
+        index=handle.index,
+        big_npy=handle.big_npy,
+        progress=progress,
+        cancel=cancel,
+    )
+    if labels is not None:
+        if stream:
+            audio_opt = _observe_stream(audio_opt, times, labels)
+        else:
+            _observe_times(times, labels)
+
+    return audio_opt, _output_sr(handle, resample_sr)
+
+
+async def _resolve_model(model_name, action):
+    if model_name:
+        if not model_loader.has_model(model_name):
+            # downloads stay with /load_model
+            info = f"Unknown model: {model_name}"
+            raise HTTPException(status_code=400, detail=info)
+        try:
+            return await run_in_threadpool(model_pool.get, model_name)
+        except Exception as e:
+            logger.warning(traceback.format_exc())
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # read the slot once, /load_model may swap it at any point
+    handle = model_loader.handle
+    if handle is None:
+        info = f"Use load model API before {action}."
+        raise HTTPException(status_code=400, detail=info)
+    return handle
+
+
+async def _tts_audio(tts_text, tts_voice, speed, labels):
+    if speed >= 0:
+        speed_str = f"+{speed}%"
+    else:
+        speed_str = f"{speed}%"
+
+    voice = "-".join(tts_voice.split("-")[:-1])
+    cache_key = tts_audio_cache.make_key(tts_text, voice, speed_str)
+    audio = await run_in_threadpool(tts_audio_cache.get, cache_key)
+    if audio is None:
+        with STAGE_SECONDS.time(stage="edge_tts", **labels):
+            tts_audio = await fetch_tts_audio(tts_text, voice, speed_str)
+        audio = await _decode(tts_audio, labels)
+        await run_in_threadpool(tts_audio_cache.put, cache_key, audio)
+    return audio
+
+
+def _split_text(tts_text):
+    sentences = split_sentences(tts_text, gpu_config.tts_sentence_max_chars)
+    if not sentences:
+        raise HTTPException(status_code=400, detail="Text should not be empty.")
+    return sentences
+
+
+def _fetch_sentences(sentences, tts_voice, speed, labels, fetch_limit=None):
+    # start every edge_tts fetch now, bounded by fetch_limit, and hand back
+    # the tasks in text order
+    fetch_limit = fetch_limit or asyncio.Semaphore(gpu_config.tts_fetch_concurrency)
+
+    async def fetch(sentence):
+        async with fetch_limit:
+            return await _tts_audio(sentence, tts_voice, speed, labels)
+
+    return [asyncio.ensure_future(fetch(sentence)) for sentence in sentences]
+
+
+async def _run_job(job):
+    params = job.params
+    handle = await _resolve_model(params["model_name"], job.kind)
+    labels = _labels(handle, params["f0_method"], "jobs")
+    if job.kind == "tts":
+        return await _tts_render(
+            handle,
+            labels,
+            params["tts_text"],
+            params["tts_voice"],
+            params["speed"],
+            params["f0_up_key"],
+            params["f0_method"],
+            params["index_rate"],
+            params["protect"],
+            params["filter_radius"],
+            params["resample_sr"],
+            params["rms_mix_rate"],
+            progress=job.progress,
+        )
+
+    data = await run_in_threadpool(_read_file, job_manager.input_path(job.id))
+    audio = await _decode(data, labels, suffix=params["suffix"])
+
+    audio_opt, tgt_sr = await executor.run(
+        labels,
+        _convert,
+        handle,
+        audio,
+        params["f0_up_key"],
+        params["f0_method"],
+        params["index_rate"],
+        params["protect"],
+        params["filter_radius"],
+        params["resample_sr"],
+        params["rms_mix_rate"],
+        progress=job.progress,
+        labels=labels,
+    )
+    return await run_in_threadpool(_encode, audio_opt, tgt_sr, labels)
+
+
+job_manager = JobManager(
+    gpu_config.job_root,
+    gpu_config.job_workers,
+    gpu_config.job_queue_size,
+    _run_job,
+    gpu_config.job_ttl,
+)
+
+
+class _ClosingStreamingResponse(StreamingResponse):
+    # the body's own finally only runs once iteration has started, a client
+    # that leaves before the first chunk would otherwise keep the fetches
+    # running and the admission ticket held
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+
+async def _stream_pcm(handle, labels, fetches, convert_args, ticket):
+    sr = _output_sr(handle, convert_args[5])
+    overlap = sr * gpu_config.tts_crossfade_ms // 1000
+    yield streaming_wav_header(sr)
+    # one limiter across the whole text so loudness does not jump back up
+    # at every sentence, and the last few ms of each chunk held back so the
+    # next sentence can crossfade into them like /tts does
+    limiter = [1.0]
+    tail = None
+    for fetch in fetches:
+        audio = await fetch
+        segments, _ = _convert(
+            handle, audio, *convert_args, stream=True, labels=labels, limiter=limiter
+        )
+        seam = True
+        while True:
+            # pull segments through the executor so the loop never runs
+            # inference
+            chunk = await executor.run(labels, next, segments, None)
+            if chunk is None:
+                break
+            if tail is not None:
+                chunk = crossfade_concat([tail, chunk], overlap if seam else 0)
+            seam = False
+            cut = max(0, len(chunk) - overlap)
+            tail = chunk[cut:]
+            if cut:
+                yield chunk[:cut].tobytes()
+    if tail is not None and len(tail):
+        yield tail.tobytes()
+    # only a stream that ran to the end tells admission how long work takes
+    ticket.release()
 
 
 @app.get("/")
@@ -31,24 +665,105 @@ def health_check():
 
 
 @app.get("/model_weights")
-def get_models():
+async def get_models():
     try:
-        return model_loader.model_list
+        # only models whose files changed since the last call are re-read
+        return await run_in_threadpool(model_registry.refresh)
     except Exception as e:
         return {"error": str(e)}
 
 
+@app.get("/ready")
+def get_ready():
+    # 503 until every preloaded model is resident
+    stats = preloader.stats()
+    return JSONResponse(stats, status_code=200 if stats["ready"] else 503)
+
+
+@app.get("/executor_stats")
+def get_executor_stats():
+    return executor.stats()
+
+
+@app.get("/admission_stats")
+def get_admission_stats():
+    return admission.stats()
+
+
+@app.get("/batch_stats")
+def get_batch_stats():
+    if batcher is None:
+        return {"message": "Micro-batching is disabled"}
+    return batcher.stats()
+
+
+@app.get("/worker_stats")
+def get_worker_stats():
+    # under serve.py every worker answers for itself only
+    return {
+        "worker": os.environ.get("RVC_WORKER_ID"),
+        "pid": os.getpid(),
+        "cores": sorted(os.sched_getaffinity(0)),
+        "threads_per_worker": executor.threads_per_worker,
+        "memory": process_memory(),
+    }
+
+
+@app.get("/model_pool")
+def get_model_pool():
+    return {
+        **model_pool.stats(),
+        "default": model_loader.model_name,
+        "live": ModelHandle.live(),
+    }
+
+
+@app.get("/cache_stats")
+def get_cache_stats():
+    return {
+        "tts": tts_cache.stats(),
+        "edge_tts": tts_audio_cache.stats(),
+        "sentence": sentence_cache.stats(),
+        "in_flight": tts_flight.stats(),
+    }
+
+
+@app.get("/metrics")
+def get_metrics():
+    for state, value in executor.stats().items():
+        EXECUTOR_GAUGE.set(value, state=state)
+    pool_stats = model_pool.stats()
+    for state in ("budget_bytes", "total_bytes", "hits", "misses", "evictions"):
+        MODEL_POOL_GAUGE.set(pool_stats[state], state=state)
+    MODEL_POOL_GAUGE.set(len(pool_stats["models"]), state="models")
+    for state, value in admission.stats().items():
+        ADMISSION_GAUGE.set(value, state=state)
+    PROCESS_RSS.set(process_rss())
+    for state, value in process_memory().items():
+        PROCESS_MEMORY.set(value, state=state)
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
 @app.post("/load_model/{model_name:path}")
 async def load_model(model_name: str):
+    if "http" not in model_name and not model_loader.has_model(model_name):
+        raise HTTPException(status_code=400, detail=f"Unknown model: {model_name}")
     try:
-        model_loader.load(model_name)
+        # build off the event loop, then publish with one reference swap;
+        # requests already running keep the handle they resolved
+        handle = await run_in_threadpool(model_pool.get, model_name)
+        model_loader.use(handle)
         return {"message": "Loaded model successfully"}
     except Exception as e:
-        return HTTPException(status_code=500, detail=str(e))
+        logger.warning(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/rvc")
 async def rvc_api(
+    request: Request,
     f0_up_key: int = Form(0),
     f0_method: str = Form("rmvpe"),
     index_rate: int = Form(1),
@@ -57,67 +772,369 @@ async def rvc_api(
     resample_sr: int = Form(0),
     rms_mix_rate: float = Form(0.25),
     audio_file: UploadFile = File(None),
+    model_name: str = Form(None),
+    output_format: str = Form(None, alias="format"),
 ):
-    # temp file
-    edge_output_filename = "edge_output.mp3"
-    file_path = os.path.join(os.getcwd(), edge_output_filename)
+    handle = await _resolve_model(model_name, "rvc")
+    labels = _labels(handle, f0_method, "rvc")
+    fmt = _output_format(output_format, request.headers.get("accept"))
 
-    tgt_sr, net_g, vc, version, index_file, if_f0 = (
-        model_loader.tgt_sr,
-        model_loader.net_g,
-        model_loader.vc,
-        model_loader.version,
-        model_loader.index_file,
-        model_loader.if_f0,
-    )
-    if not tgt_sr or not model_loader.model_name:
-        info = "Use load model API before rvc."
+    try:
+        # Use custom wav file
+        suffix = os.path.splitext(audio_file.filename or "")[1] or ".wav"
+        audio = await _decode(await audio_file.read(), labels, suffix=suffix)
+
+        duration = len(audio) / 16000
+        async with _cancellation(request, "rvc") as cancel:
+            with _admit(handle, "rvc", f0_method, index_rate, duration=duration):
+                audio_opt, tgt_sr = await executor.run(
+                    labels,
+                    _convert,
+                    handle,
+                    audio,
+                    f0_up_key,
+                    f0_method,
+                    index_rate,
+                    protect,
+                    filter_radius,
+                    resample_sr,
+                    rms_mix_rate,
+                    labels=labels,
+                    cancel=cancel,
+                )
+        content = await run_in_threadpool(_encode, audio_opt, tgt_sr, labels, fmt)
+        return _audio_response(content, "rvc_output", fmt)
+
+    except HTTPException:
+        raise
+    except EOFError:
+        info = "It seems that the edge-tts output is not valid. This may occur when the input text and the speaker do not match. For example, maybe you entered Japanese (without alphabets) text but chose a non-Japanese speaker?"
         raise HTTPException(status_code=400, detail=info)
+    except Exception as e:
+        info = str(e)
+        logger.warning(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=info)
+
+
+@app.post("/rvc/raw")
+async def rvc_raw_api(
+    request: Request,
+    sample_rate: int = 16000,
+    dtype: str = "float32",
+    channels: int = 1,
+    f0_up_key: int = 0,
+    f0_method: str = "rmvpe",
+    index_rate: int = 1,
+    protect: float = 0.33,
+    filter_radius: int = 3,
+    resample_sr: int = 0,
+    rms_mix_rate: float = 0.25,
+    model_name: str = None,
+    output_format: str = Query(None, alias="format"),
+):
+    # the body is bare PCM, conversion settings come in the query string
+    handle = await _resolve_model(model_name, "rvc")
+    labels = _labels(handle, f0_method, "rvc/raw")
 
     try:
-        # Use custom wav file
-        with open(edge_output_filename, "wb") as wav:
-            wav.write(audio_file.file.read())
-
-        audio, sr = librosa.load(edge_output_filename, sr=16000, mono=True)
-
-        f0_up_key = int(f0_up_key)
-        if f0_method == "rmvpe":
-            vc.model_rmvpe = rmvpe_model
-
-        times = [0, 0, 0]
-        audio_opt = vc.pipeline(
-            hubert_model,
-            net_g,
-            0,
-            audio,
-            edge_output_filename,
-            times,
+        data = await request.body()
+        audio = await _decode_raw(data, labels, sample_rate, dtype, channels)
+
+        duration = len(audio) / 16000
+        async with _cancellation(request, "rvc/raw") as cancel:
+            with _admit(handle, "rvc/raw", f0_method, index_rate, duration=duration):
+                audio_opt, tgt_sr = await executor.run(
+                    labels,
+                    _convert,
+                    handle,
+                    audio,
+                    f0_up_key,
+                    f0_method,
+                    index_rate,
+                    protect,
+                    filter_radius,
+                    resample_sr,
+                    rms_mix_rate,
+                    labels=labels,
+                    cancel=cancel,
+                )
+        if "application/octet-stream" in request.headers.get("accept", ""):
+            # mono int16 little-endian, no container
+            return Response(
+                content=audio_opt.astype("<i2").tobytes(),
+                media_type="application/octet-stream",
+                headers={
+                    "X-Sample-Rate": str(tgt_sr),
+                    "X-Dtype": "int16",
+                    "X-Channels": "1",
+                },
+            )
+        fmt = _output_format(output_format, request.headers.get("accept"))
+        content = await run_in_threadpool(_encode, audio_opt, tgt_sr, labels, fmt)
+        return _audio_response(content, "rvc_output", fmt)
+
+    except HTTPException:
+        raise
+    except EOFError:
+        raise HTTPException(status_code=400, detail="Empty audio input")
+    except Exception as e:
+        info = str(e)
+        logger.warning(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=info)
+
+
+def _tts_cache_key(
+    handle,
+    tts_text,
+    speed,
+    tts_voice,
+    f0_up_key,
+    f0_method,
+    index_rate,
+    protect,
+    filter_radius,
+    resample_sr,
+    rms_mix_rate,
+):
+    return tts_cache.make_key(
+        tts_text=tts_text,
+        speed=speed,
+        tts_voice=tts_voice,
+        f0_up_key=f0_up_key,
+        f0_method=f0_method,
+        index_rate=index_rate,
+        protect=protect,
+        filter_radius=filter_radius,
+        resample_sr=resample_sr,
+        rms_mix_rate=rms_mix_rate,
+        model=handle.fingerprint,
+        # the text is split and the sentences joined by these
+        sentence_max_chars=gpu_config.tts_sentence_max_chars,
+        crossfade_ms=gpu_config.tts_crossfade_ms,
+    )
+
+
+def _sentence_cache_key(handle, sentence, tts_voice, speed, rvc_args):
+    f0_up_key, f0_method, index_rate, protect, filter_radius, resample_sr, rms = (
+        rvc_args
+    )
+    # edge_tts renders a sentence the same way whatever text surrounds it, so
+    # the converted audio can be shared by every text that contains it
+    sentence = unicodedata.normalize("NFKC", " ".join(sentence.split()))
+    return sentence_cache.make_key(
+        sentence=sentence,
+        tts_voice=tts_voice,
+        speed=speed,
+        f0_up_key=f0_up_key,
+        f0_method=f0_method,
+        index_rate=index_rate,
+        protect=protect,
+        filter_radius=filter_radius,
+        resample_sr=resample_sr,
+        rms_mix_rate=rms,
+        model=handle.fingerprint,
+    )
+
+
+def _variant_key(cache_key, fmt):
+    if fmt == "wav":
+        return cache_key
+    return tts_cache.make_key(source=cache_key, format=fmt)
+
+
+async def _cached_wav(cache_key, fmt):
+    # a compressed variant that missed can still be made from the cached wav
+    if fmt == "wav":
+        return None
+    file_path = await run_in_threadpool(tts_cache.get, cache_key)
+    if file_path is None:
+        return None
+    return await run_in_threadpool(_read_file, file_path)
+
+
+async def _tts_variant(cache_key, fmt, wav, labels):
+    # compressed copies are cached next to the wav, so each is encoded once
+    if fmt == "wav":
+        return wav
+    content = await run_in_threadpool(_transcode, wav, fmt, labels)
+    await run_in_threadpool(
+        tts_cache.put, _variant_key(cache_key, fmt), content, f".{fmt}"
+    )
+    return content
+
+
+async def _tts_render(
+    handle,
+    labels,
+    tts_text,
+    tts_voice,
+    speed,
+    f0_up_key,
+    f0_method,
+    index_rate,
+    protect,
+    filter_radius,
+    resample_sr,
+    rms_mix_rate,
+    progress=None,
+    fetch_limit=None,
+    sentence_stats=None,
+    cancel=None,
+    endpoint=None,
+):
+    sentences = _split_text(tts_text)
+    rvc_args = (
+        f0_up_key,
+        f0_method,
+        index_rate,
+        protect,
+        filter_radius,
+        resample_sr,
+        rms_mix_rate,
+    )
+    keys = [
+        _sentence_cache_key(handle, sentence, tts_voice, speed, rvc_args)
+        for sentence in sentences
+    ]
+    cached = await run_in_threadpool(lambda: list(map(sentence_cache.get_array, keys)))
+    missing = [i for i, audio_opt in enumerate(cached) if audio_opt is None]
+    if sentence_stats is not None:
+        sentence_stats["sentences"] = len(sentences)
+        sentence_stats["hits"] = len(sentences) - len(missing)
+
+    # admission only counts the sentences that still need converting, a
+    # fully cached text does no work at all
+    ticket = nullcontext()
+    if endpoint is not None and missing:
+        text = "".join(sentences[i] for i in missing)
+        ticket = _admit(handle, endpoint, f0_method, index_rate, text=text)
+
+    # only the sentences nobody has said before go out to edge_tts
+    fetches = _fetch_sentences(
+        [sentences[i] for i in missing], tts_voice, speed, labels, fetch_limit
+    )
+    done = len(sentences) - len(missing)
+    if progress is not None and done:
+        progress(done, len(sentences))
+
+    async def convert(i, fetch):
+        nonlocal done
+        # each sentence converts as soon as its own audio is in
+        audio = await fetch
+        if cancel is not None:
+            cancel.check()
+        audio_opt, _ = await executor.run(
+            labels, _convert, handle, audio, *rvc_args, labels=labels, cancel=cancel
+        )
+        await run_in_threadpool(sentence_cache.put_array, keys[i], audio_opt)
+        cached[i] = audio_opt
+        done += 1
+        if progress is not None:
+            progress(done, len(sentences))
+
+    tasks = [
+        asyncio.ensure_future(convert(i, fetch)) for i, fetch in zip(missing, fetches)
+    ]
+    try:
+        with ticket:
+            await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks + fetches:
+            task.cancel()
+        raise
+
+    sr = _output_sr(handle, resample_sr)
+    audio_opt = await run_in_threadpool(
+        crossfade_concat, cached, sr * gpu_config.tts_crossfade_ms // 1000
+    )
+    return await run_in_threadpool(_encode, audio_opt, sr, labels)
+
+
+@app.post("/tts")
+async def tts_api(
+    request: Request,
+    speed: int = Form(...),
+    tts_text: str = Form(...),
+    tts_voice: str = Form(...),
+    f0_up_key: int = Form(0),
+    f0_method: str = Form("rmvpe"),
+    index_rate: int = Form(1),
+    protect: float = Form(0.33),
+    filter_radius: int = Form(3),
+    resample_sr: int = Form(0),
+    rms_mix_rate: float = Form(0.25),
+    model_name: str = Form(None),
+    output_format: str = Form(None, alias="format"),
+):
+    handle = await _resolve_model(model_name, "tts")
+    fmt = _output_format(output_format, request.headers.get("accept"))
+    cache_key = _tts_cache_key(
+        handle,
+        tts_text,
+        speed,
+        tts_voice,
+        f0_up_key,
+        f0_method,
+        index_rate,
+        protect,
+        filter_radius,
+        resample_sr,
+        rms_mix_rate,
+    )
+    variant_key = _variant_key(cache_key, fmt)
+    labels = _labels(handle, f0_method, "tts")
+
+    entry = await run_in_threadpool(tts_cache.lookup, variant_key)
+    if entry is not None:
+        # answers a matching If-None-Match with a 304 as well
+        file_path, digest = entry
+        return await _cached_audio_response(
+            request, digest, cache_key, fmt, path=file_path
+        )
+
+    async def render(cancel):
+        sentence_stats = {}
+        wav = await _tts_render(
+            handle,
+            labels,
+            tts_text,
+            tts_voice,
+            speed,
             f0_up_key,
             f0_method,
-            index_file,
             index_rate,
-            if_f0,
+            protect,
             filter_radius,
-            tgt_sr,
             resample_sr,
             rms_mix_rate,
-            version,
-            protect,
-            None,
+            sentence_stats=sentence_stats,
+            cancel=cancel,
+            endpoint="tts",
         )
-        sf.write(edge_output_filename, audio_opt, tgt_sr, format="WAV")
+        await run_in_threadpool(tts_cache.put, cache_key, wav)
+        return wav, sentence_stats
 
-        if tgt_sr != resample_sr >= 16000:
-            tgt_sr = resample_sr
+    try:
+        wav, sentence_stats = await _cached_wav(cache_key, fmt), None
+        if wav is None:
+            async with _cancellation(request, "tts") as cancel:
+                # identical requests arriving before the first one is cached
+                # wait for it instead of rendering the same audio again
+                wav, sentence_stats = await tts_flight.do(cache_key, render, cancel)
 
-        return FileResponse(
-            file_path,
-            headers={
-                f"Content-Disposition": "attachment; filename={edge_output_filename}"
-            },
+        content = await _tts_variant(cache_key, fmt, wav, labels)
+        headers = {}
+        if sentence_stats is not None:
+            headers["X-Sentence-Cache"] = "{hits}/{sentences}".format(
+                **sentence_stats
+            )
+        digest = await run_in_threadpool(tts_cache.digest, content)
+        return await _cached_audio_response(
+            request, digest, cache_key, fmt, content=content, headers=headers
         )
 
+    except HTTPException:
+        raise
     except EOFError:
         info = "It seems that the edge-tts output is not valid. This may occur when the input text and the speaker do not match. For example, maybe you entered Japanese (without alphabets) text but chose a non-Japanese speaker?"
         raise HTTPException(status_code=400, detail=info)
@@ -127,8 +1144,180 @@ async def rvc_api(
         raise HTTPException(status_code=500, detail=info)
 
 
-@app.post("/tts")
-async def tts_api(
+class TTSBatchItem(BaseModel):
+    tts_text: str
+    tts_voice: str
+    speed: int = 0
+    f0_up_key: int = 0
+    f0_method: str = "rmvpe"
+    index_rate: int = 1
+    protect: float = 0.33
+    filter_radius: int = 3
+    resample_sr: int = 0
+    rms_mix_rate: float = 0.25
+
+
+class TTSBatchRequest(BaseModel):
+    items: List[TTSBatchItem]
+    model_name: Optional[str] = None
+    format: Optional[str] = None
+
+
+def _uncached_text(handle, item, fmt):
+    # the part of a batch item no cache can serve, what admission charges for
+    cache_key = _tts_cache_key(
+        handle,
+        item.tts_text,
+        item.speed,
+        item.tts_voice,
+        item.f0_up_key,
+        item.f0_method,
+        item.index_rate,
+        item.protect,
+        item.filter_radius,
+        item.resample_sr,
+        item.rms_mix_rate,
+    )
+    if tts_cache.contains(_variant_key(cache_key, fmt)) or tts_cache.contains(
+        cache_key
+    ):
+        return ""
+    rvc_args = (
+        item.f0_up_key,
+        item.f0_method,
+        item.index_rate,
+        item.protect,
+        item.filter_radius,
+        item.resample_sr,
+        item.rms_mix_rate,
+    )
+    return "".join(
+        sentence
+        for sentence in split_sentences(
+            item.tts_text, gpu_config.tts_sentence_max_chars
+        )
+        if not sentence_cache.contains(
+            _sentence_cache_key(handle, sentence, item.tts_voice, item.speed, rvc_args)
+        )
+    )
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@app.post("/tts/batch")
+async def tts_batch_api(request: TTSBatchRequest, http_request: Request):
+    if len(request.items) > gpu_config.tts_batch_max_items:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch should have at most {gpu_config.tts_batch_max_items} items, but got {len(request.items)}.",
+        )
+    handle = await _resolve_model(request.model_name, "tts")
+    # members are zipped, so only the explicit format field applies
+    fmt = _output_format(request.format, None)
+    fetch_limit = asyncio.Semaphore(gpu_config.tts_fetch_concurrency)
+
+    async def synthesize(item, cancel):
+        cache_key = _tts_cache_key(
+            handle,
+            item.tts_text,
+            item.speed,
+            item.tts_voice,
+            item.f0_up_key,
+            item.f0_method,
+            item.index_rate,
+            item.protect,
+            item.filter_radius,
+            item.resample_sr,
+            item.rms_mix_rate,
+        )
+        file_path = await run_in_threadpool(tts_cache.get, _variant_key(cache_key, fmt))
+        if file_path is not None:
+            return cache_key, await run_in_threadpool(_read_file, file_path)
+
+        labels = _labels(handle, item.f0_method, "tts/batch")
+        wav = await _cached_wav(cache_key, fmt)
+        if wav is not None:
+            return cache_key, await _tts_variant(cache_key, fmt, wav, labels)
+        # conversion queues on the executor while other items are still fetching
+        wav = await _tts_render(
+            handle,
+            labels,
+            item.tts_text,
+            item.tts_voice,
+            item.speed,
+            item.f0_up_key,
+            item.f0_method,
+            item.index_rate,
+            item.protect,
+            item.filter_radius,
+            item.resample_sr,
+            item.rms_mix_rate,
+            fetch_limit=fetch_limit,
+            cancel=cancel,
+        )
+        await run_in_threadpool(tts_cache.put, cache_key, wav)
+        return cache_key, await _tts_variant(cache_key, fmt, wav, labels)
+
+    # the items all arrive at once, so the batch is admitted as a whole, for
+    # the sentences none of the caches has yet
+    cost = sum(
+        _cost(handle, item.f0_method, item.index_rate, text=text)
+        for item, text in zip(
+            request.items,
+            await run_in_threadpool(
+                lambda: [_uncached_text(handle, item, fmt) for item in request.items]
+            ),
+        )
+        if text
+    )
+    ticket = _admit_cost(cost, "tts/batch") if cost else None
+
+    completed = False
+    try:
+        async with _cancellation(http_request, "tts/batch") as cancel:
+            results = await asyncio.gather(
+                *(synthesize(item, cancel) for item in request.items),
+                return_exceptions=True,
+            )
+            cancelled = [r for r in results if isinstance(r, Cancelled)]
+            if cancelled:
+                # nobody is waiting for the rest of the zip
+                raise cancelled[0]
+        completed = not any(isinstance(r, BaseException) for r in results)
+    finally:
+        if ticket is not None:
+            ticket.release(observe=completed)
+
+    errors = []
+    buf = io.BytesIO()
+    # audio barely deflates, just store the members
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+        for i, result in enumerate(results):
+            if isinstance(result, BaseException):
+                if not isinstance(result, HTTPException):
+                    logger.warning(
+                        "".join(traceback.format_exception(type(result), result, None))
+                    )
+                detail = getattr(result, "detail", None) or str(result)
+                errors.append({"index": i, "error": detail})
+                continue
+            cache_key, content = result
+            zf.writestr(f"{i:04d}_{cache_key[:16]}.{fmt}", content)
+        if errors:
+            zf.writestr("errors.json", json.dumps(errors, ensure_ascii=False))
+
+    return Response(
+        content=buf.getvalue(),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=tts_batch.zip"},
+    )
+
+
+@app.post("/tts/stream")
+async def tts_stream_api(
     speed: int = Form(...),
     tts_text: str = Form(...),
     tts_voice: str = Form(...),
@@ -139,101 +1328,44 @@ async def tts_api(
     filter_radius: int = Form(3),
     resample_sr: int = Form(0),
     rms_mix_rate: float = Form(0.25),
+    model_name: str = Form(None),
 ):
-    _hash_str = (
-        tts_text
-        + str(speed)
-        + str(tts_voice)
-        + str(f0_up_key)
-        + str(model_loader.model_name)
-    )
-    hash_file = f'{hashlib.md5(_hash_str.encode("utf-8")).hexdigest()}.wav'
-    file_path = os.path.join(os.getcwd(), "audio", hash_file)
-
-    if os.path.exists(file_path):
-        return FileResponse(
-            file_path,
-            headers={
-                f"Content-Disposition": "attachment; filename={hash_file}"
-            },
-        )
+    handle = await _resolve_model(model_name, "tts")
+    labels = _labels(handle, f0_method, "tts/stream")
 
-    tgt_sr, net_g, vc, version, index_file, if_f0 = (
-        model_loader.tgt_sr,
-        model_loader.net_g,
-        model_loader.vc,
-        model_loader.version,
-        model_loader.index_file,
-        model_loader.if_f0,
-    )
-    if not tgt_sr:
-        info = "Use load model API before tts."
-        raise HTTPException(status_code=400, detail=info)
-
-    # temp file
-    edge_output_filename = "edge_output.mp3"
     try:
-        if len(tts_text) > 500:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Text characters should be at most 500, but got {len(tts_text)} characters.",
-            )
-        if speed >= 0:
-            speed_str = f"+{speed}%"
-        else:
-            speed_str = f"{speed}%"
-
-        await edge_tts.Communicate(
-            tts_text, "-".join(tts_voice.split("-")[:-1]), rate=speed_str
-        ).save(edge_output_filename)
-
-        audio, sr = librosa.load(edge_output_filename, sr=16000, mono=True)
-        duration = len(audio) / sr
-        if duration >= 80:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Audio should be less than 80 seconds, but got {duration}s.",
-            )
+        sentences = _split_text(tts_text)
+        ticket = _admit(handle, "tts/stream", f0_method, index_rate, text=tts_text)
+        fetches = _fetch_sentences(sentences, tts_voice, speed, labels)
 
-        f0_up_key = int(f0_up_key)
-        if f0_method == "rmvpe":
-            vc.model_rmvpe = rmvpe_model
-
-        times = [0, 0, 0]
-        audio_opt = vc.pipeline(
-            hubert_model,
-            net_g,
-            0,
-            audio,
-            edge_output_filename,
-            times,
+        def release():
+            for fetch in fetches:
+                fetch.cancel()
+            ticket.release(observe=False)
+
+        try:
+            # surface edge_tts errors before the 200 and WAV header go out
+            await asyncio.shield(fetches[0])
+        except BaseException:
+            release()
+            raise
+        convert_args = (
             f0_up_key,
             f0_method,
-            index_file,
             index_rate,
-            if_f0,
+            protect,
             filter_radius,
-            tgt_sr,
             resample_sr,
             rms_mix_rate,
-            version,
-            protect,
-            None,
         )
-
-        sf.write(hash_file, audio_opt, tgt_sr, format="WAV")
-        shutil.move(hash_file, file_path)
-
-        if tgt_sr != resample_sr >= 16000:
-            tgt_sr = resample_sr
-
-        return FileResponse(
-            file_path,
-            headers={
-                f"Content-Disposition": "attachment; filename={hash_file}"
-            },
+        return _ClosingStreamingResponse(
+            _stream_pcm(handle, labels, fetches, convert_args, ticket),
+            release,
+            media_type="audio/wav",
         )
 
+    except HTTPException:
+        raise
     except EOFError:
         info = "It seems that the edge-tts output is not valid. This may occur when the input text and the speaker do not match. For example, maybe you entered Japanese (without alphabets) text but chose a non-Japanese speaker?"
         raise HTTPException(status_code=400, detail=info)
@@ -243,5 +1375,151 @@ async def tts_api(
         raise HTTPException(status_code=500, detail=info)
 
 
+@app.post("/jobs")
+async def create_job(
+    kind: str = Form(...),
+    priority: int = Form(0),
+    speed: int = Form(0),
+    tts_text: str = Form(None),
+    tts_voice: str = Form(None),
+    f0_up_key: int = Form(0),
+    f0_method: str = Form("rmvpe"),
+    index_rate: int = Form(1),
+    protect: float = Form(0.33),
+    filter_radius: int = Form(3),
+    resample_sr: int = Form(0),
+    rms_mix_rate: float = Form(0.25),
+    model_name: str = Form(None),
+    audio_file: UploadFile = File(None),
+):
+    if kind not in ("tts", "rvc"):
+        raise HTTPException(status_code=400, detail="Job kind should be tts or rvc.")
+    if kind == "tts" and (not tts_text or not tts_voice):
+        info = "tts jobs need tts_text and tts_voice."
+        raise HTTPException(status_code=400, detail=info)
+    if kind == "rvc" and audio_file is None:
+        raise HTTPException(status_code=400, detail="rvc jobs need an audio_file.")
+    if not model_name and model_loader.handle is None:
+        info = f"Use load model API before {kind}."
+        raise HTTPException(status_code=400, detail=info)
+
+    params = {
+        "speed": speed,
+        "tts_text": tts_text,
+        "tts_voice": tts_voice,
+        "f0_up_key": f0_up_key,
+        "f0_method": f0_method,
+        "index_rate": index_rate,
+        "protect": protect,
+        "filter_radius": filter_radius,
+        "resample_sr": resample_sr,
+        "rms_mix_rate": rms_mix_rate,
+        # pin the model at submit time, /load_model may change before it runs
+        "model_name": model_name or model_loader.model_name,
+    }
+    data = None
+    if kind == "rvc":
+        params["suffix"] = os.path.splitext(audio_file.filename or "")[1] or ".wav"
+        data = await audio_file.read()
+
+    try:
+        job = await job_manager.submit(kind, priority, params, data)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Job queue is full.")
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, request: Request):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    if job["status"] != "done":
+        info = f"Job is {job['status']}, no result yet."
+        raise HTTPException(status_code=409, detail=info)
+    return await _cached_audio_response(
+        request, job_id, job_id, path=job_manager.result_path(job_id)
+    )
+
+
+@app.websocket("/ws/rvc")
+async def rvc_ws(
+    websocket: WebSocket,
+    model_name: str = None,
+    f0_up_key: int = 0,
+    f0_method: str = "rmvpe",
+    index_rate: float = 1,
+    protect: float = 0.33,
+    block_ms: int = None,
+    context_ms: int = None,
+    crossfade_ms: int = None,
+):
+    await websocket.accept()
+    if block_ms is None:
+        block_ms = gpu_config.rt_block_ms
+    if context_ms is None:
+        context_ms = gpu_config.rt_context_ms
+    if crossfade_ms is None:
+        crossfade_ms = gpu_config.rt_crossfade_ms
+    for name, value in (("block_ms", block_ms), ("context_ms", context_ms)):
+        if value <= 0:
+            await websocket.close(code=1008, reason=f"{name} must be positive")
+            return
+    if crossfade_ms < 0:
+        # 0 turns the crossfade off
+        await websocket.close(code=1008, reason="crossfade_ms must not be negative")
+        return
+    try:
+        handle = await _resolve_model(model_name, "rvc")
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+
+    session = RealtimeSession(
+        handle,
+        hubert_model,
+        rmvpe_model,
+        block_ms * 16,
+        context_ms * 16,
+        crossfade_ms * 16,
+        f0_up_key,
+        f0_method,
+        index_rate,
+        protect,
+    )
+    labels = _labels(handle, f0_method, "ws/rvc")
+    # input is float32 mono PCM at 16 kHz, output is float32 mono at "sr"
+    await websocket.send_json(
+        {
+            "sr": handle.tgt_sr,
+            "block_size": session.block,
+            "output_block_size": session.block_tgt,
+        }
+    )
+    try:
+        while True:
+            data = await websocket.receive_bytes()
+            for block in session.feed(data):
+                start = time.perf_counter()
+                out = await executor.run(labels, session.process, block)
+                await websocket.send_bytes(out.tobytes())
+                latency = time.perf_counter() - start
+                session.observe(latency)
+                STAGE_SECONDS.observe(latency, stage="realtime_block", **labels)
+                await websocket.send_json(
+                    {"block": session.blocks, "latency_ms": latency * 1000}
+                )
+    except WebSocketDisconnect:
+        logger.info(f"Realtime session closed: {session.stats()}")
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=5021)
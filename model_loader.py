@@ -1,9 +1,19 @@
 import os
+import json
+import time
 import torch
+import faiss
 import logging
+import weakref
+import threading
+import traceback
 import requests
 import zipfile
 from fairseq import checkpoint_utils
+from torch.nn.utils import parametrize, remove_weight_norm
+from torch.nn.utils.weight_norm import WeightNorm
+from safetensors import safe_open
+from safetensors.torch import load_file, save_file
 
 from lib.infer_pack.models import (
     SynthesizerTrnMs256NSFsid,
@@ -13,9 +23,149 @@ from lib.infer_pack.models import (
 )
 from src.config import Config
 from src.vc_infer_pipeline import VC
+from src.metrics import MODEL_LOAD_SECONDS
 
 logging.getLogger("fairseq").setLevel(logging.WARNING)
 
+# bump when the converted weights change shape, old files get rebuilt
+CONVERTED_FORMAT = "2"
+
+
+def source_stamp(path):
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def fold_weight_norm(module):
+    # bake weight norm into plain weights so inference stops renormalizing
+    # every conv on every forward, GeneratorNSF and ResBlocks use the old
+    # hook style and WN uses parametrizations
+    folded = 0
+    for m in list(module.modules()):
+        if parametrize.is_parametrized(m):
+            for name in list(m.parametrizations.keys()):
+                if any(
+                    type(p).__name__ == "_WeightNorm" for p in m.parametrizations[name]
+                ):
+                    parametrize.remove_parametrizations(
+                        m, name, leave_parametrized=True
+                    )
+                    folded += 1
+        for hook in list(m._forward_pre_hooks.values()):
+            if isinstance(hook, WeightNorm):
+                remove_weight_norm(m, hook.name)
+                folded += 1
+    return folded
+
+
+def _probe(net_g, if_f0, frames=64):
+    # a fixed random utterance through infer, the seed also pins the noise
+    # that the flow and the NSF source draw
+    sources = [m for m in net_g.modules() if getattr(m, "is_half", False)]
+    # the NSF source casts to half on its own, the probe runs in float32
+    for m in sources:
+        m.is_half = False
+    try:
+        with torch.random.fork_rng(devices=[]), torch.no_grad():
+            torch.manual_seed(0)
+            phone = torch.randn(1, frames, net_g.enc_p.emb_phone.in_features)
+            lengths = torch.tensor([frames]).long()
+            sid = torch.tensor([0]).long()
+            if if_f0 == 1:
+                pitch = torch.randint(1, 255, (1, frames)).long()
+                nsff0 = torch.rand(1, frames) * 300 + 80
+                return net_g.infer(phone, lengths, pitch, nsff0, sid)[0]
+            return net_g.infer(phone, lengths, sid)[0]
+    finally:
+        for m in sources:
+            m.is_half = True
+
+
+def _released(model_name):
+    # runs once the last request, pool slot or default slot lets go
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    print(f"Released model: {model_name}")
+
+
+class ModelHandle:
+    # immutable once built, requests keep the handle they started with while
+    # /load_model or the pool swap in another one
+    _live = weakref.WeakSet()
+
+    def __init__(
+        self,
+        model_name,
+        pth_path,
+        tgt_sr,
+        net_g,
+        vc,
+        version,
+        index_file,
+        if_f0,
+        index=None,
+        big_npy=None,
+        load_kind=None,
+        load_seconds=None,
+    ):
+        self.model_name = model_name
+        self.pth_path = pth_path
+        self.tgt_sr = tgt_sr
+        self.net_g = net_g
+        self.vc = vc
+        self.version = version
+        self.index_file = index_file
+        self.if_f0 = if_f0
+        self.index = index
+        self.big_npy = big_npy
+        # "cold" when converted from the .pth, "warm" from the weight cache
+        self.load_kind = load_kind
+        self.load_seconds = load_seconds
+        self.nbytes = self._estimate_bytes()
+        self.fingerprint = self._fingerprint()
+        self._frozen = True
+        ModelHandle._live.add(self)
+        weakref.finalize(self, _released, model_name)
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError(f"ModelHandle is immutable, cannot set {name}")
+        super().__setattr__(name, value)
+
+    @classmethod
+    def live(cls):
+        # handles still referenced, including retired ones in-flight requests
+        # are finishing with
+        return sorted(handle.model_name for handle in cls._live)
+
+    def is_current(self):
+        # False once the .pth or .index on disk changed since this was built
+        try:
+            return self._fingerprint() == self.fingerprint
+        except OSError:
+            return False
+
+    def _fingerprint(self):
+        # identifies the exact weights for cache keys, a retrained model with
+        # the same name must not hit old entries
+        parts = [self.model_name]
+        for path in (self.pth_path, self.index_file):
+            if path:
+                st = os.stat(path)
+                name = os.path.basename(path)
+                parts.append(f"{name}:{st.st_size}:{st.st_mtime_ns}")
+        return "|".join(parts)
+
+    def _estimate_bytes(self):
+        nbytes = sum(
+            t.numel() * t.element_size()
+            for t in list(self.net_g.parameters()) + list(self.net_g.buffers())
+        )
+        if self.big_npy is not None:
+            # the faiss index keeps its own copy of the vectors
+            nbytes += self.big_npy.nbytes * 2
+        return nbytes
+
 
 class ModelLoader:
     def __init__(self):
@@ -29,15 +179,11 @@ class ModelLoader:
         if len(self.model_list) == 0:
             raise ValueError("No model found in `weights` folder")
 
-        self.model_name = ""
         self.model_list.sort()
 
-        self.tgt_sr = None
-        self.net_g = None
-        self.vc = None
-        self.version = None
-        self.index_file = None
-        self.if_f0 = None
+        # the default model, replaced as a whole by a single assignment
+        self.handle = None
+        self._use_lock = threading.Lock()
 
     def _load_from_zip_url(self, url):
         response = requests.get(url)
@@ -58,7 +204,17 @@ class ModelLoader:
             print("Could not download model: {model_name}")
         return model_name
 
-    def load(self, model_name):
+    def has_model(self, model_name):
+        # only plain directory names under the model root, so request fields
+        # cannot point elsewhere on disk or trigger a download
+        return (
+            bool(model_name)
+            and os.path.basename(model_name) == model_name
+            and model_name not in (".", "..")
+            and os.path.isdir(os.path.join(self.model_root, model_name))
+        )
+
+    def build(self, model_name):
         if "http" in model_name:
             model_name = self._load_from_zip_url(model_name)
 
@@ -72,44 +228,60 @@ class ModelLoader:
                 f"No pth file found in {self.model_root}/{model_name}"
             )
 
-        self.model_name = model_name
         pth_path = pth_files[0]
         print(f"Loading {pth_path}, model: {model_name}")
 
-        cpt = torch.load(pth_path, map_location="cpu")
-        self.tgt_sr = cpt["config"][-1]
-        cpt["config"][-3] = cpt["weight"]["emb_g.weight"].shape[0]  # n_spk
-        self.if_f0 = cpt.get("f0", 1)
-        self.version = cpt.get("version", "v1")
+        start = time.perf_counter()
+        converted_path = self._converted_path(pth_path)
+        converted = self._read_converted(converted_path, pth_path)
+        if converted is not None:
+            load_kind = "warm"
+            metadata, weights = converted
+            config = json.loads(metadata["config"])
+            if_f0 = int(metadata["f0"])
+            version = metadata["version"]
+        else:
+            load_kind = "cold"
+            cpt = torch.load(pth_path, map_location="cpu")
+            config = cpt["config"]
+            config[-3] = cpt["weight"]["emb_g.weight"].shape[0]  # n_spk
+            if_f0 = cpt.get("f0", 1)
+            version = cpt.get("version", "v1")
+            weights = cpt["weight"]
+        tgt_sr = config[-1]
 
-        if self.version == "v1":
-            if self.if_f0 == 1:
-                self.net_g = SynthesizerTrnMs256NSFsid(
-                    *cpt["config"], is_half=self.config.is_half
-                )
-            else:
-                self.net_g = SynthesizerTrnMs256NSFsid_nono(*cpt["config"])
-        elif self.version == "v2":
-            if self.if_f0 == 1:
-                self.net_g = SynthesizerTrnMs768NSFsid(
-                    *cpt["config"], is_half=self.config.is_half
-                )
-            else:
-                self.net_g = SynthesizerTrnMs768NSFsid_nono(*cpt["config"])
+        if load_kind == "warm":
+            # the cached weights are already folded and cast; the module is
+            # only shaped on the meta device and then adopts the mapped
+            # tensors, so no parameters are allocated or initialised first.
+            # The synthesizers register no buffers that would stay behind.
+            with torch.device("meta"):
+                net_g = self._synthesizer(config, if_f0, version)
+            fold_weight_norm(net_g)
+            net_g.load_state_dict(weights, assign=True)
+            net_g = net_g.half() if self.config.is_half else net_g.float()
         else:
-            raise ValueError("Unknown version")
+            net_g = self._synthesizer(config, if_f0, version)
+            net_g.load_state_dict(weights, strict=False)
 
-        del self.net_g.enc_q
-        self.net_g.load_state_dict(cpt["weight"], strict=False)
-        print("Model loaded")
-        self.net_g.eval().to(self.config.device)
+            def unfolded():
+                net_g = self._synthesizer(config, if_f0, version)
+                net_g.load_state_dict(weights, strict=False)
+                return net_g.float().eval()
 
-        if self.config.is_half:
-            self.net_g = self.net_g.half()
-        else:
-            self.net_g = self.net_g.float()
+            net_g, folded = self._prepare(net_g.float().eval(), if_f0, unfolded)
+            net_g = net_g.half() if self.config.is_half else net_g
+            if folded:
+                self._write_converted(
+                    converted_path, pth_path, net_g, config, if_f0, version
+                )
+        del weights
+        net_g.eval().to(self.config.device)
+        load_seconds = time.perf_counter() - start
+        MODEL_LOAD_SECONDS.observe(load_seconds, kind=load_kind)
+        print(f"Model loaded ({load_kind}) in {load_seconds:.2f}s")
 
-        self.vc = VC(self.tgt_sr, self.config)
+        vc = VC(tgt_sr, self.config)
 
         index_files = [
             os.path.join(self.model_root, model_name, f)
@@ -117,12 +289,124 @@ class ModelLoader:
             if f.endswith(".index")
         ]
 
+        index = big_npy = None
         if len(index_files) == 0:
             print("No index file found")
-            self.index_file = ""
+            index_file = ""
+        else:
+            index_file = index_files[0]
+            print(f"Index file found: {index_file}")
+            try:
+                index = faiss.read_index(index_file)
+                big_npy = index.reconstruct_n(0, index.ntotal)
+            except Exception:
+                traceback.print_exc()
+                index = big_npy = None
+
+        handle = ModelHandle(
+            model_name,
+            pth_path,
+            tgt_sr,
+            net_g,
+            vc,
+            version,
+            index_file,
+            if_f0,
+            index,
+            big_npy,
+            load_kind=load_kind,
+            load_seconds=load_seconds,
+        )
+        return handle
+
+    def _synthesizer(self, config, if_f0, version):
+        if version == "v1":
+            if if_f0 == 1:
+                net_g = SynthesizerTrnMs256NSFsid(*config, is_half=self.config.is_half)
+            else:
+                net_g = SynthesizerTrnMs256NSFsid_nono(*config)
+        elif version == "v2":
+            if if_f0 == 1:
+                net_g = SynthesizerTrnMs768NSFsid(*config, is_half=self.config.is_half)
+            else:
+                net_g = SynthesizerTrnMs768NSFsid_nono(*config)
         else:
-            self.index_file = index_files[0]
-            print(f"Index file found: {self.index_file}")
+            raise ValueError("Unknown version")
+        del net_g.enc_q
+        return net_g
+
+    def _prepare(self, net_g, if_f0, unfolded):
+        # probe, fold in place and probe again; modules under weight norm
+        # cannot be deep-copied, so on a mismatch a fresh unfolded one is
+        # built from the checkpoint instead
+        expected = _probe(net_g, if_f0)
+        folded = fold_weight_norm(net_g)
+        error = (_probe(net_g, if_f0) - expected).abs().max().item()
+        error /= max(expected.abs().max().item(), 1e-8)
+        if error > 1e-4:
+            print(f"Folded model differs by {error:.2e}, keeping weight norm")
+            return unfolded(), False
+        print(f"Folded weight norm on {folded} layers, difference {error:.2e}")
+        return net_g, True
+
+    def _converted_path(self, pth_path):
+        dtype = "fp16" if self.config.is_half else "fp32"
+        return f"{os.path.splitext(pth_path)[0]}.{dtype}.safetensors"
+
+    def _read_converted(self, path, pth_path):
+        # mmaps the converted weights, None if missing or older than the .pth
+        if not os.path.exists(path):
+            return None
+        try:
+            with safe_open(path, framework="pt") as f:
+                metadata = f.metadata() or {}
+            if (
+                metadata.get("format") != CONVERTED_FORMAT
+                or metadata.get("source") != source_stamp(pth_path)
+            ):
+                return None
+            return metadata, load_file(path)
+        except Exception:
+            traceback.print_exc()
+            return None
+
+    def _write_converted(self, path, pth_path, net_g, config, if_f0, version):
+        metadata = {
+            "format": CONVERTED_FORMAT,
+            "source": source_stamp(pth_path),
+            "config": json.dumps(list(config)),
+            "f0": str(if_f0),
+            "version": version,
+        }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            weights = {k: v.contiguous() for k, v in net_g.state_dict().items()}
+            save_file(weights, tmp_path, metadata=metadata)
+            os.replace(tmp_path, path)
+        except Exception:
+            # the next load simply converts again
+            traceback.print_exc()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def use(self, handle):
+        # readers either see the old handle or the new one, never a mix; the
+        # old one is freed once nothing references it anymore
+        self.handle = handle
+
+    def use_default(self, handle):
+        # only takes the slot if nobody has picked a model yet
+        with self._use_lock:
+            if self.handle is None:
+                self.handle = handle
+
+    @property
+    def model_name(self):
+        handle = self.handle
+        return handle.model_name if handle is not None else ""
+
+    def load(self, model_name):
+        self.use(self.build(model_name))
 
     def load_hubert(self):
         models, _, _ = checkpoint_utils.load_model_ensemble_and_task(
@@ -0,0 +1,176 @@
+import time
+import logging
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class ModelPool:
+    def __init__(self, loader, budget_bytes):
+        self.loader = loader
+        self.budget_bytes = budget_bytes
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def total_bytes(self):
+        # the default model stays resident whether or not it is pooled, so it
+        # always counts against the budget
+        handles = {id(handle): handle for handle in self._models.values()}
+        default = self.loader.handle
+        if default is not None:
+            handles[id(default)] = default
+        return sum(handle.nbytes for handle in handles.values())
+
+    def _load_lock(self, model_name):
+        with self._lock:
+            return self._load_locks.setdefault(model_name, threading.Lock())
+
+    def _hit(self, model_name):
+        # a resident handle built from the files still on disk; a replaced
+        # .pth or .index makes it a miss and the model is built again
+        with self._lock:
+            handle = self._models.get(model_name)
+        if handle is None or not handle.is_current():
+            return None
+        with self._lock:
+            if model_name in self._models:
+                self._models.move_to_end(model_name)
+            self.hits += 1
+        return handle
+
+    def get(self, model_name):
+        handle = self._hit(model_name)
+        if handle is not None:
+            return handle
+
+        # one load per model at a time, other models can load in parallel
+        with self._load_lock(model_name):
+            handle = self._hit(model_name)
+            if handle is not None:
+                return handle
+            with self._lock:
+                self.misses += 1
+
+            handle = self.loader.build(model_name)
+            with self._lock:
+                self._models[handle.model_name] = handle
+                self._evict()
+            return handle
+
+    def _evict(self):
+        # always keep the most recently used model, even if it alone is over,
+        # and never the default one, evicting it would free nothing
+        default = self.loader.handle
+        while self.total_bytes > self.budget_bytes:
+            model_name = next(
+                (
+                    name
+                    for name in list(self._models)[:-1]
+                    if self._models[name] is not default
+                ),
+                None,
+            )
+            if model_name is None:
+                break
+            del self._models[model_name]
+            self.evictions += 1
+            print(f"Evicted model: {model_name}")
+
+    def resident(self):
+        with self._lock:
+            return set(self._models)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "budget_bytes": self.budget_bytes,
+                "total_bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "models": {
+                    name: handle.nbytes for name, handle in self._models.items()
+                },
+            }
+
+
+class Preloader:
+    def __init__(self, pool, model_names, workers, on_loaded=None):
+        self.pool = pool
+        self.model_names = list(model_names)
+        self.workers = workers
+        self.on_loaded = on_loaded
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stopped = False
+        self.models = {
+            name: {"state": "pending", "seconds": None, "error": None}
+            for name in self.model_names
+        }
+
+    def start(self):
+        if not self.model_names:
+            return
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="rvc-preload"
+        )
+        for model_name in self.model_names:
+            self._executor.submit(self._load, model_name)
+
+    def _load(self, model_name):
+        if self._stopped:
+            return
+        with self._lock:
+            self.models[model_name]["state"] = "loading"
+        start = time.perf_counter()
+        try:
+            handle = self.pool.get(model_name)
+        except Exception as e:
+            traceback.print_exc()
+            state, error, handle = "failed", str(e), None
+        else:
+            state, error = "ready", None
+        with self._lock:
+            self.models[model_name].update(
+                state=state, seconds=time.perf_counter() - start, error=error
+            )
+        if handle is not None and self.on_loaded is not None:
+            self.on_loaded(handle)
+        evicted = [
+            name for name, m in self.stats()["models"].items() if m["state"] == "evicted"
+        ]
+        if evicted:
+            logger.warning(
+                f"Preloaded models {', '.join(evicted)} were evicted, the preload "
+                "set does not fit RVC_MODEL_POOL_MB"
+            )
+
+    @property
+    def ready(self):
+        return self.stats()["ready"]
+
+    def stats(self):
+        # a model the pool has since evicted is no longer ready
+        resident = self.pool.resident()
+        with self._lock:
+            models = {name: dict(m) for name, m in self.models.items()}
+        for name, m in models.items():
+            if m["state"] == "ready" and name not in resident:
+                m["state"] = "evicted"
+        return {
+            "ready": all(m["state"] == "ready" for m in models.values()),
+            "models": models,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._stopped = True
+            self._executor.shutdown(wait=False)
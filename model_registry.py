@@ -0,0 +1,148 @@
+import os
+import json
+import torch
+import threading
+import traceback
+from safetensors import safe_open
+
+from model_loader import CONVERTED_FORMAT, source_stamp
+
+# bump when the extracted fields change, the whole index is rebuilt
+REGISTRY_VERSION = 1
+
+
+class ModelRegistry:
+    def __init__(self, model_root, index_path=None):
+        self.model_root = model_root
+        self.index_path = index_path or os.path.join(model_root, "registry.json")
+        self._lock = threading.Lock()
+        self._entries = self._read_index()
+
+    def _read_index(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if index.get("version") != REGISTRY_VERSION:
+            return {}
+        return index.get("models", {})
+
+    def _write_index(self):
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {"version": REGISTRY_VERSION, "models": self._entries},
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+        os.replace(tmp_path, self.index_path)
+
+    def _scan(self, model_name):
+        # the files that make up a model and their size/mtime stamps, cheap
+        # enough to run for every model on every refresh
+        model_dir = os.path.join(self.model_root, model_name)
+        files = sorted(os.listdir(model_dir))
+        pth = next((f for f in files if f.endswith(".pth")), None)
+        index = next((f for f in files if f.endswith(".index")), None)
+        return {
+            name: source_stamp(os.path.join(model_dir, name))
+            for name in (pth, index)
+            if name
+        }, pth, index
+
+    def _converted_metadata(self, pth_path):
+        # the safetensors header holds everything once a model has loaded
+        # once, reading it does not touch the weights
+        stem = os.path.splitext(pth_path)[0]
+        for dtype in ("fp16", "fp32"):
+            path = f"{stem}.{dtype}.safetensors"
+            if not os.path.exists(path):
+                continue
+            with safe_open(path, framework="pt") as f:
+                metadata = f.metadata() or {}
+                if (
+                    metadata.get("format") == CONVERTED_FORMAT
+                    and metadata.get("source") == source_stamp(pth_path)
+                ):
+                    config = json.loads(metadata["config"])
+                    return {
+                        "version": metadata["version"],
+                        "tgt_sr": config[-1],
+                        "if_f0": int(metadata["f0"]),
+                        "n_spk": config[-3],
+                    }
+        return None
+
+    def _read_metadata(self, pth_path):
+        metadata = self._converted_metadata(pth_path)
+        if metadata is not None:
+            return metadata
+        try:
+            # zip checkpoints are mapped rather than read, only the small
+            # config and the speaker embedding are touched
+            cpt = torch.load(pth_path, map_location="cpu", mmap=True)
+        except Exception:
+            cpt = torch.load(pth_path, map_location="cpu")
+        return {
+            "version": cpt.get("version", "v1"),
+            "tgt_sr": cpt["config"][-1],
+            "if_f0": cpt.get("f0", 1),
+            "n_spk": cpt["weight"]["emb_g.weight"].shape[0],
+        }
+
+    def refresh(self):
+        # re-read only the models whose files changed since the last scan
+        with self._lock:
+            changed = False
+            names = sorted(
+                d
+                for d in os.listdir(self.model_root)
+                if os.path.isdir(os.path.join(self.model_root, d))
+            )
+            for model_name in set(self._entries) - set(names):
+                del self._entries[model_name]
+                changed = True
+
+            for model_name in names:
+                files, pth, index = self._scan(model_name)
+                entry = self._entries.get(model_name)
+                if entry is not None and entry["files"] == files:
+                    continue
+                entry = {"files": files, "pth": pth, "index": index}
+                if pth is None:
+                    entry["error"] = "No pth file found"
+                else:
+                    pth_path = os.path.join(self.model_root, model_name, pth)
+                    try:
+                        entry.update(self._read_metadata(pth_path))
+                    except Exception as e:
+                        traceback.print_exc()
+                        entry["error"] = str(e)
+                self._entries[model_name] = entry
+                changed = True
+
+            if changed:
+                try:
+                    self._write_index()
+                except OSError:
+                    traceback.print_exc()
+            return self._list()
+
+    def models(self):
+        with self._lock:
+            return self._list()
+
+    def _list(self):
+        return [
+            {
+                "name": model_name,
+                "has_index": entry.get("index") is not None,
+                "size_bytes": sum(
+                    int(stamp.split(":")[0]) for stamp in entry["files"].values()
+                ),
+                **{k: v for k, v in entry.items() if k != "files"},
+            }
+            for model_name, entry in sorted(self._entries.items())
+        ]
@@ -0,0 +1,154 @@
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+import torch
+import uvicorn
+
+from src.metrics import process_memory
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("serve")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Load the models once and fork workers that share them."
+    )
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5021)
+    parser.add_argument(
+        "--workers", type=int, default=int(os.environ.get("RVC_WORKERS", 2))
+    )
+    parser.add_argument(
+        "--preload",
+        default=os.environ.get("RVC_PRELOAD", ""),
+        help='Comma separated voice models, or "all", to load before forking.',
+    )
+    parser.add_argument(
+        "--report-interval",
+        type=float,
+        default=60,
+        help="Seconds between worker memory reports, 0 disables them.",
+    )
+    return parser.parse_args()
+
+
+def core_slices(workers):
+    # split the cores this process may run on into one slice per worker
+    cores = sorted(os.sched_getaffinity(0))
+    size = max(1, len(cores) // workers)
+    return [
+        [cores[(i * size + j) % len(cores)] for j in range(size)]
+        for i in range(workers)
+    ]
+
+
+def run_worker(app, sock, worker_id, cores):
+    os.environ["RVC_WORKER_ID"] = str(worker_id)
+    os.sched_setaffinity(0, cores)
+    # each inference thread gets an equal share of this worker's cores
+    threads = max(1, len(cores) // app.executor.workers)
+    app.executor.threads_per_worker = threads
+    torch.set_num_threads(threads)
+    logger.info(f"Worker {worker_id} (pid {os.getpid()}) on cores {cores}")
+    server = uvicorn.Server(uvicorn.Config(app.app, log_level="info"))
+    server.run(sockets=[sock])
+
+
+def report_memory(children):
+    for worker_id, pid in sorted(children.items()):
+        memory = process_memory(pid)
+        logger.info(
+            f"Worker {worker_id} (pid {pid}): "
+            + ", ".join(f"{k}={v / 2**20:.0f}MB" for k, v in memory.items())
+        )
+
+
+def main():
+    args = parse_args()
+
+    # importing app loads HuBERT, RMVPE and the executor once, here
+    import app
+
+    if app.gpu_config.device.startswith("cuda"):
+        # CUDA contexts do not survive fork
+        sys.exit("Pre-forked workers need CPU inference, run app.py on GPUs.")
+
+    # every worker runs its own job queue on the shared RVC_JOB_ROOT, a job
+    # runs where it was submitted and its progress is read back from disk
+
+    # loaded here the weights are shared by every worker, the workers' own
+    # preloaders then find them in the pool
+    preload = app._preload_list(args.preload)
+    for model_name in preload:
+        handle = app.model_pool.get(model_name)
+        if model_name == preload[0]:
+            # the first listed model is the default, as in app.py
+            app.model_loader.use_default(handle)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    # move everything loaded so far out of the collector's reach, otherwise
+    # the first collection in each worker touches and copies those pages
+    gc.collect()
+    gc.freeze()
+
+    slices = core_slices(args.workers)
+    children = {}
+    stopping = False
+
+    def spawn(worker_id):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                run_worker(app, sock, worker_id, slices[worker_id])
+            finally:
+                os._exit(0)
+        children[worker_id] = pid
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children.values()):
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for worker_id in range(args.workers):
+        spawn(worker_id)
+    logger.info(f"Master {os.getpid()} listening on {args.host}:{args.port}")
+
+    last_report = time.monotonic()
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            worker_id = next(w for w, p in children.items() if p == pid)
+            del children[worker_id]
+            if not stopping:
+                logger.warning(f"Worker {worker_id} exited ({status}), restarting")
+                spawn(worker_id)
+            continue
+        now = time.monotonic()
+        if args.report_interval and now - last_report > args.report_interval:
+            report_memory(children)
+            last_report = now
+        time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import math
+import time
+import threading
+
+from src.metrics import ADMISSION_REQUESTS
+
+# compute per second of audio relative to rmvpe, harvest runs on the cpu
+# and dominates everything else
+F0_COST = {"pm": 0.5, "rmvpe": 1.0, "crepe": 2.0, "harvest": 6.0}
+INDEX_COST = 1.3
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Server is overloaded, retry after {retry_after}s.")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, budget, workers, rtf, seconds_per_char, smoothing=0.2):
+        self.budget = budget
+        self.workers = workers
+        self.rtf = rtf
+        self.seconds_per_char = seconds_per_char
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self.pending = 0.0
+        self.in_flight = 0
+        self.accepted = 0
+        self.shed = 0
+
+    def estimate(self, duration, f0_method, use_index):
+        # estimated seconds of worker time for `duration` seconds of audio
+        cost = duration * F0_COST.get(f0_method, 1.0)
+        if use_index:
+            cost *= INDEX_COST
+        return cost * self.rtf
+
+    def estimate_text(self, text, f0_method, use_index):
+        return self.estimate(len(text) * self.seconds_per_char, f0_method, use_index)
+
+    def admit(self, cost, endpoint):
+        # raises Overloaded right away, otherwise the returned ticket holds
+        # the cost until its with block exits
+        if self.budget <= 0:
+            return _Ticket(None, 0.0, 0.0)
+        with self._lock:
+            # the work already queued drains across all workers before this
+            # request is done, an idle server always accepts
+            latency = (self.pending + cost) / self.workers
+            if self.in_flight and latency > self.budget:
+                self.shed += 1
+                ADMISSION_REQUESTS.inc(endpoint=endpoint, result="shed")
+                raise Overloaded(max(1, math.ceil(latency - self.budget)))
+            self.accepted += 1
+            self.pending += cost
+            self.in_flight += 1
+        ADMISSION_REQUESTS.inc(endpoint=endpoint, result="accepted")
+        return _Ticket(self, cost, latency)
+
+    def _release(self, cost, latency, elapsed):
+        # elapsed is None for requests that failed or were cut short, their
+        # time says nothing about how long the work takes
+        with self._lock:
+            self.pending -= cost
+            self.in_flight -= 1
+            if elapsed is not None and latency > 0:
+                # keep the real time factor in line with what requests
+                # actually take on this machine
+                ratio = min(max(elapsed / latency, 0.25), 4.0)
+                self.rtf *= 1 + self.smoothing * (ratio - 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "budget": self.budget,
+                "rtf": self.rtf,
+                "pending": self.pending,
+                "in_flight": self.in_flight,
+                "accepted": self.accepted,
+                "shed": self.shed,
+            }
+
+
+class _Ticket:
+    def __init__(self, controller, cost, latency):
+        self.controller = controller
+        self.cost = cost
+        self.latency = latency
+        self.start = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release(observe=exc_type is None)
+        return False
+
+    def release(self, observe=True):
+        if self.controller is not None:
+            elapsed = time.perf_counter() - self.start if observe else None
+            self.controller._release(self.cost, self.latency, elapsed)
+            self.controller = None
@@ -0,0 +1,194 @@
+import io
+import os
+import time
+import struct
+import tempfile
+import numpy as np
+import librosa
+import edge_tts
+import soundfile as sf
+from math import gcd
+from functools import lru_cache
+from scipy import signal
+
+# Prefer a RAM-backed filesystem for the rare uploads we have to spill.
+SPILL_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def _load_spilled(data, suffix):
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix="rvc_", dir=SPILL_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return librosa.load(path, sr=None, mono=True)
+    finally:
+        os.remove(path)
+
+
+def _decode(data, spill_threshold, suffix):
+    if len(data) <= spill_threshold:
+        try:
+            return librosa.load(io.BytesIO(data), sr=None, mono=True)
+        except RuntimeError:
+            # libsndfile could not decode it (e.g. old builds without mp3),
+            # fall back to a per-request temp file so audioread can handle it
+            pass
+    return _load_spilled(data, suffix)
+
+
+def load_audio(data, spill_threshold, sr=16000, suffix=".mp3", timings=None):
+    if not data:
+        raise EOFError("Empty audio input")
+
+    t0 = time.perf_counter()
+    audio, orig_sr = _decode(data, spill_threshold, suffix)
+    t1 = time.perf_counter()
+    if orig_sr != sr:
+        audio = librosa.resample(audio, orig_sr=orig_sr, target_sr=sr)
+    t2 = time.perf_counter()
+    if timings is not None:
+        timings["decode"] = t1 - t0
+        timings["resample"] = t2 - t1
+    return audio
+
+
+RAW_DTYPES = {
+    "int16": np.dtype("<i2"),
+    "int32": np.dtype("<i4"),
+    "float32": np.dtype("<f4"),
+}
+
+
+@lru_cache(maxsize=32)
+def _resample_taps(up, down):
+    # same filter resample_poly designs on every call, built once per ratio
+    max_rate = max(up, down)
+    return signal.firwin(20 * max_rate + 1, 1.0 / max_rate, window=("kaiser", 5.0))
+
+
+def fast_resample(audio, orig_sr, target_sr):
+    g = gcd(orig_sr, target_sr)
+    up, down = target_sr // g, orig_sr // g
+    return signal.resample_poly(audio, up, down, window=_resample_taps(up, down))
+
+
+def load_raw(data, orig_sr, dtype, channels, sr=16000, timings=None):
+    # view a raw PCM body in place, only mixing down, scaling and resampling
+    # copy it and only when the input needs them
+    if not data:
+        raise EOFError("Empty audio input")
+    if dtype not in RAW_DTYPES:
+        raise ValueError(
+            f"dtype should be one of {', '.join(RAW_DTYPES)}, but got {dtype}."
+        )
+    dtype = RAW_DTYPES[dtype]
+    if channels < 1 or len(data) % (dtype.itemsize * channels):
+        raise ValueError(
+            f"Body of {len(data)} bytes does not hold whole frames of "
+            f"{channels} {dtype.name} samples."
+        )
+
+    t0 = time.perf_counter()
+    audio = np.frombuffer(data, dtype=dtype)
+    if channels > 1:
+        audio = audio.reshape(-1, channels).mean(axis=1, dtype=np.float32)
+    if dtype.kind == "i":
+        audio = audio * np.float32(-1.0 / np.iinfo(dtype).min)
+    t1 = time.perf_counter()
+    if orig_sr != sr:
+        audio = fast_resample(audio, orig_sr, sr).astype(np.float32)
+    t2 = time.perf_counter()
+    if timings is not None:
+        timings["decode"] = t1 - t0
+        timings["resample"] = t2 - t1
+    return audio
+
+
+def encode_wav(audio, sr):
+    buf = io.BytesIO()
+    sf.write(buf, audio, sr, format="WAV")
+    return buf.getvalue()
+
+
+# name: (media type, soundfile format, subtype)
+OUTPUT_FORMATS = {
+    "wav": ("audio/wav", "WAV", "PCM_16"),
+    "flac": ("audio/flac", "FLAC", "PCM_16"),
+    "ogg": ("audio/ogg", "OGG", "VORBIS"),
+    "opus": ("audio/ogg; codecs=opus", "OGG", "OPUS"),
+    "mp3": ("audio/mpeg", "MP3", "MPEG_LAYER_III"),
+}
+# encoders that only run at a handful of rates, 40k models go up to 48k
+ENCODER_RATES = {
+    "OPUS": (8000, 12000, 16000, 24000, 48000),
+    "MPEG_LAYER_III": (
+        8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000,
+    ),
+}
+
+
+def _available(format, subtype):
+    # mp3 needs libsndfile 1.1 and opus 1.0.29, older builds lack them
+    return format in sf.available_formats() and subtype in sf.available_subtypes(
+        format
+    )
+
+
+AVAILABLE_FORMATS = [
+    name
+    for name, (_, format, subtype) in OUTPUT_FORMATS.items()
+    if _available(format, subtype)
+]
+
+
+def encode_audio(audio, sr, fmt="wav"):
+    _, format, subtype = OUTPUT_FORMATS[fmt]
+    if sr not in ENCODER_RATES.get(subtype, (sr,)):
+        audio = fast_resample(audio.astype(np.float32) / 32768, sr, 48000)
+        sr = 48000
+    buf = io.BytesIO()
+    sf.write(buf, audio, sr, format=format, subtype=subtype)
+    return buf.getvalue()
+
+
+def transcode_wav(wav, fmt):
+    audio, sr = sf.read(io.BytesIO(wav), dtype="int16")
+    return encode_audio(audio, sr, fmt)
+
+
+def crossfade_concat(chunks, overlap):
+    # join int16 clips, blending `overlap` samples at every seam
+    pieces = [chunks[0].astype(np.float32)]
+    for chunk in chunks[1:]:
+        chunk = chunk.astype(np.float32)
+        n = min(overlap, len(pieces[-1]), len(chunk))
+        if n:
+            fade = np.linspace(0, 1, n, dtype=np.float32)
+            chunk[:n] = chunk[:n] * fade + pieces[-1][-n:] * (1 - fade)
+            pieces[-1] = pieces[-1][:-n]
+        pieces.append(chunk)
+    return np.clip(np.concatenate(pieces), -32768, 32767).astype(np.int16)
+
+
+def streaming_wav_header(sr, channels=1, bits=16):
+    # total length is unknown up front, use the max size like most streamers
+    data_size = 0xFFFFFFFF - 36
+    block_align = channels * bits // 8
+    return (
+        b"RIFF"
+        + struct.pack("<I", data_size + 36)
+        + b"WAVEfmt "
+        + struct.pack(
+            "<IHHIIHH", 16, 1, channels, sr, sr * block_align, block_align, bits
+        )
+        + b"data"
+        + struct.pack("<I", data_size)
+    )
+
+
+async def fetch_tts_audio(text, voice, rate):
+    chunks = []
+    async for chunk in edge_tts.Communicate(text, voice, rate=rate).stream():
+        if chunk["type"] == "audio":
+            chunks.append(chunk["data"])
+    return b"".join(chunks)
@@ -0,0 +1,113 @@
+import os
+import time
+import threading
+import torch
+from collections import Counter
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    def __init__(
+        self, max_batch_size, max_wait, max_batch_samples, bucket, threads=None
+    ):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_batch_samples = max_batch_samples
+        # segments whose lengths round up to the same multiple of `bucket`
+        # samples share a batch, the shorter ones are padded to the longest
+        self.bucket = bucket
+        # every batch runs on the one batcher thread, give it the same
+        # intra-op share as an executor worker
+        self.threads = threads
+        self._pending = []
+        self.batch_sizes = Counter()
+        self._start()
+        # threads do not survive fork, a forked worker needs its own
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._loop, name="rvc-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, key, run_batch, item):
+        # item[0] is the padded segment audio, used for length bucketing
+        future = Future()
+        with self._cond:
+            self._pending.append((key, run_batch, item, future, time.perf_counter()))
+            self._cond.notify()
+        return future
+
+    def _bucket(self, entry):
+        return -(-len(entry[2][0]) // self.bucket)
+
+    def _select(self):
+        first = self._pending[0]
+        arrived = first[4]
+        # every member is padded up to at most the bucket's upper edge
+        length = self._bucket(first) * self.bucket
+        batch = []
+        for entry in self._pending:
+            if not self._same_batch(entry, first):
+                continue
+            if batch and length * (len(batch) + 1) > self.max_batch_samples:
+                break
+            batch.append(entry)
+            if len(batch) >= self.max_batch_size:
+                break
+        return batch, arrived
+
+    def _same_batch(self, entry, first):
+        return entry[0] == first[0] and self._bucket(entry) == self._bucket(first)
+
+    def _loop(self):
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                while True:
+                    batch, arrived = self._select()
+                    remaining = arrived + self.max_wait - time.perf_counter()
+                    full = len(batch) >= self.max_batch_size or len(batch) < len(
+                        [e for e in self._pending if self._same_batch(e, batch[0])]
+                    )
+                    if full or remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                for entry in batch:
+                    self._pending.remove(entry)
+
+            # skip segments whose request was cancelled while they waited
+            batch = [
+                entry for entry in batch if entry[3].set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+            run_batch = batch[0][1]
+            try:
+                results = run_batch([entry[2] for entry in batch])
+            except Exception as e:
+                for entry in batch:
+                    entry[3].set_exception(e)
+            else:
+                for entry, result in zip(batch, results):
+                    entry[3].set_result(result)
+            with self._cond:
+                self.batch_sizes[len(batch)] += 1
+
+    def stats(self):
+        with self._cond:
+            batches = sum(self.batch_sizes.values())
+            items = sum(size * n for size, n in self.batch_sizes.items())
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait": self.max_wait,
+                "pending": len(self._pending),
+                "batches": batches,
+                "items": items,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            }
@@ -0,0 +1,175 @@
+import io
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import numpy as np
+
+from src.metrics import CACHE_REQUESTS, CACHE_EVICTIONS
+
+# bump when the pipeline output changes so stale entries are never served
+CACHE_VERSION = 2
+
+
+class AudioCache:
+    def __init__(self, root, max_bytes, max_entries, name):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.name = name
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = self._connect()
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, path TEXT, size INTEGER, last_access REAL, "
+            "digest TEXT)"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(entries)")]
+        if "digest" not in columns:
+            self._db.execute("ALTER TABLE entries ADD COLUMN digest TEXT")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access)"
+        )
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # a forked worker must not share the parent's sqlite connection
+        os.register_at_fork(after_in_child=self._reopen)
+
+    def _connect(self):
+        db = sqlite3.connect(
+            os.path.join(self.root, "index.sqlite"),
+            check_same_thread=False,
+            isolation_level=None,
+            timeout=30,
+        )
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def _reopen(self):
+        self._lock = threading.Lock()
+        self._db = self._connect()
+
+    @staticmethod
+    def make_key(**params):
+        params["cache_version"] = CACHE_VERSION
+        canonical = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def digest(data):
+        # identifies the stored bytes themselves, used as the ETag
+        return hashlib.sha256(data).hexdigest()
+
+    def path_for(self, key, suffix=".wav"):
+        # two levels of 256 shards keep directories small
+        return os.path.join(self.root, key[:2], key[2:4], f"{key}{suffix}")
+
+    def get(self, key):
+        entry = self.lookup(key)
+        return entry[0] if entry is not None else None
+
+    def contains(self, key):
+        # a peek that neither counts as a request nor refreshes the entry
+        with self._lock:
+            row = self._db.execute(
+                "SELECT path, digest FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+        return row is not None and row[1] is not None and os.path.exists(row[0])
+
+    def lookup(self, key):
+        # (path, digest) of a cached entry, None on a miss
+        with self._lock:
+            row = self._db.execute(
+                "SELECT path, digest FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[1] is not None and os.path.exists(row[0]):
+                self._db.execute(
+                    "UPDATE entries SET last_access = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+                self.hits += 1
+                CACHE_REQUESTS.inc(cache=self.name, result="hit")
+                return row
+            if row is not None:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.misses += 1
+        CACHE_REQUESTS.inc(cache=self.name, result="miss")
+        return None
+
+    def put(self, key, data, suffix=".wav"):
+        path = self.path_for(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write next to the target and rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        digest = self.digest(data)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(key, path, size, last_access, digest) VALUES (?, ?, ?, ?, ?)",
+                (key, path, len(data), time.time(), digest),
+            )
+            self._evict()
+        return path
+
+    def get_array(self, key):
+        path = self.get(key)
+        if path is None:
+            return None
+        return np.load(path)
+
+    def put_array(self, key, array):
+        buf = io.BytesIO()
+        np.save(buf, array)
+        return self.put(key, buf.getvalue(), suffix=".npy")
+
+    def _evict(self):
+        count, total = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        rows = self._db.execute(
+            "SELECT key, path, size FROM entries ORDER BY last_access"
+        )
+        evicted = []
+        for key, path, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            evicted.append((key, path))
+            count -= 1
+            total -= size
+        for key, path in evicted:
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            if os.path.exists(path):
+                os.remove(path)
+            self.evictions += 1
+            CACHE_EVICTIONS.inc(cache=self.name)
+
+    def stats(self):
+        with self._lock:
+            count, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+            return {
+                "entries": count,
+                "bytes": total,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,53 @@
+import time
+
+
+class Cancelled(Exception):
+    def __init__(self, reason):
+        super().__init__(f"Conversion was cancelled ({reason}).")
+        self.reason = reason
+
+
+class CancelToken:
+    # polled by the pipeline between stages and segments, set from the event
+    # loop when the client goes away or by the clock once the deadline passes
+    def __init__(self, timeout=None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self._reason = None
+
+    def cancel(self, reason="cancelled"):
+        if self._reason is None:
+            self._reason = reason
+
+    @property
+    def reason(self):
+        if self._reason is None and self.deadline is not None:
+            if time.monotonic() > self.deadline:
+                self._reason = "deadline"
+        return self._reason
+
+    def check(self):
+        reason = self.reason
+        if reason is not None:
+            raise Cancelled(reason)
+
+
+class CancelGroup:
+    # for work shared by several requests, it only stops once every request
+    # that is waiting on it has been cancelled
+    def __init__(self, *tokens):
+        self.tokens = list(tokens)
+
+    def add(self, token):
+        self.tokens.append(token)
+
+    @property
+    def reason(self):
+        reasons = [token.reason for token in self.tokens]
+        if reasons and all(reasons):
+            return reasons[-1]
+        return None
+
+    def check(self):
+        reason = self.reason
+        if reason is not None:
+            raise Cancelled(reason)
@@ -9,7 +9,99 @@ class Config:
         self.n_cpu = 0
         self.gpu_name = None
         self.gpu_mem = None
+        # uploads larger than this are decoded from a temp file instead of memory
+        self.spill_threshold = int(
+            os.environ.get("RVC_SPILL_THRESHOLD", 32 * 1024 * 1024)
+        )
+        # seconds of audio per chunk on the streaming endpoints
+        self.stream_segment = int(os.environ.get("RVC_STREAM_SEGMENT", 8))
         self.x_pad, self.x_query, self.x_center, self.x_max = self.device_config()
+        # inference thread pool, the cores are split evenly between workers
+        self.infer_workers = int(os.environ.get("RVC_INFER_WORKERS", 1))
+        self.infer_threads = int(
+            os.environ.get(
+                "RVC_INFER_THREADS", max(1, self.n_cpu // self.infer_workers)
+            )
+        )
+        # micro-batching of segments across concurrent requests, 1 disables
+        # it; batches run one at a time on a single thread, so it only pays
+        # off when the device has parallelism a single segment leaves idle
+        self.batch_max_size = int(os.environ.get("RVC_BATCH_MAX_SIZE", 1))
+        self.batch_max_wait = (
+            float(os.environ.get("RVC_BATCH_MAX_WAIT_MS", 10)) / 1000
+        )
+        # enough for a full batch of the longest segments by default
+        self.batch_max_seconds = int(
+            os.environ.get(
+                "RVC_BATCH_MAX_SECONDS",
+                (self.x_max + 2 * self.x_pad) * self.batch_max_size,
+            )
+        )
+        # segments within this much of each other's length share a batch
+        self.batch_bucket_ms = int(os.environ.get("RVC_BATCH_BUCKET_MS", 200))
+        # memory budget for voice models kept resident in the model pool
+        self.model_pool_budget = (
+            int(os.environ.get("RVC_MODEL_POOL_MB", 2048)) * 1024 * 1024
+        )
+        # models loaded in the background at startup, comma separated or "all"
+        self.preload_models = os.environ.get("RVC_PRELOAD", "")
+        self.preload_workers = int(os.environ.get("RVC_PRELOAD_WORKERS", 2))
+        # background conversion jobs, results are kept under job_root; each
+        # worker process runs the jobs it accepted and publishes progress
+        # there, so any worker can answer for any job
+        self.job_root = os.environ.get("RVC_JOB_ROOT", "jobs")
+        self.job_workers = int(os.environ.get("RVC_JOB_WORKERS", 1))
+        self.job_queue_size = int(os.environ.get("RVC_JOB_QUEUE_SIZE", 1000))
+        self.job_ttl = int(os.environ.get("RVC_JOB_TTL_HOURS", 24)) * 3600
+        # converted /tts output cache
+        self.cache_root = os.environ.get("RVC_CACHE_ROOT", "audio")
+        self.cache_max_bytes = (
+            int(os.environ.get("RVC_CACHE_MAX_MB", 2048)) * 1024 * 1024
+        )
+        self.cache_max_entries = int(os.environ.get("RVC_CACHE_MAX_ENTRIES", 100000))
+        # cached results never change under their key, let proxies keep them
+        self.cache_max_age = int(os.environ.get("RVC_CACHE_MAX_AGE", 86400))
+        # decoded edge_tts audio, reused when only the RVC parameters change
+        self.tts_cache_root = os.environ.get("RVC_TTS_CACHE_ROOT", "cache/edge_tts")
+        self.tts_cache_memory_bytes = (
+            int(os.environ.get("RVC_TTS_CACHE_MEMORY_MB", 256)) * 1024 * 1024
+        )
+        self.tts_cache_max_bytes = (
+            int(os.environ.get("RVC_TTS_CACHE_MAX_MB", 1024)) * 1024 * 1024
+        )
+        # /tts/batch limits, edge_tts fetches run concurrently up to this many
+        self.tts_batch_max_items = int(os.environ.get("RVC_TTS_BATCH_MAX_ITEMS", 200))
+        self.tts_fetch_concurrency = int(
+            os.environ.get("RVC_TTS_FETCH_CONCURRENCY", 8)
+        )
+        # long /tts text is split into sentences converted side by side
+        self.tts_sentence_max_chars = int(
+            os.environ.get("RVC_TTS_SENTENCE_MAX_CHARS", 200)
+        )
+        self.tts_crossfade_ms = int(os.environ.get("RVC_TTS_CROSSFADE_MS", 20))
+        # converted audio per sentence, reused across different texts
+        self.sentence_cache_root = os.environ.get(
+            "RVC_SENTENCE_CACHE_ROOT", "cache/sentences"
+        )
+        self.sentence_cache_max_bytes = (
+            int(os.environ.get("RVC_SENTENCE_CACHE_MAX_MB", 2048)) * 1024 * 1024
+        )
+        # admission control: requests whose estimated latency exceeds the
+        # budget (seconds) are shed with 429, 0 disables it
+        self.admission_budget = float(os.environ.get("RVC_ADMISSION_BUDGET", 30))
+        # initial worker seconds per second of audio, refined from observed
+        # latencies, and spoken seconds per character of tts text
+        self.admission_rtf = float(os.environ.get("RVC_ADMISSION_RTF", 0.3))
+        self.admission_seconds_per_char = float(
+            os.environ.get("RVC_ADMISSION_SECONDS_PER_CHAR", 0.1)
+        )
+        # seconds a /rvc or /tts conversion may take before it is abandoned,
+        # 0 waits forever
+        self.request_deadline = float(os.environ.get("RVC_REQUEST_DEADLINE", 300))
+        # /ws/rvc defaults in milliseconds, clients may override them per connection
+        self.rt_block_ms = int(os.environ.get("RVC_RT_BLOCK_MS", 250))
+        self.rt_context_ms = int(os.environ.get("RVC_RT_CONTEXT_MS", 1000))
+        self.rt_crossfade_ms = int(os.environ.get("RVC_RT_CROSSFADE_MS", 50))
 
     # has_mps is only available in nightly pytorch (for now) and MasOS 12.3+.
     # check `getattr` and try it for compatibility
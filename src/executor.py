@@ -0,0 +1,83 @@
+import time
+import asyncio
+import threading
+import torch
+from concurrent.futures import ThreadPoolExecutor
+
+from src.metrics import QUEUE_WAIT_SECONDS
+
+
+class InferenceExecutor:
+    def __init__(self, workers, threads_per_worker):
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="rvc-infer",
+            initializer=self._init_worker,
+        )
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _init_worker(self):
+        # split the cores between workers instead of letting every worker
+        # spin up a full-size intra-op pool
+        torch.set_num_threads(self.threads_per_worker)
+
+    def _call(self, submitted, labels, fn, args, kwargs):
+        wait = time.perf_counter() - submitted
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+        QUEUE_WAIT_SECONDS.observe(wait, **labels)
+        try:
+            return fn(*args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    async def run(self, labels, fn, *args, **kwargs):
+        # labels (model, f0_method, endpoint) break the queue wait down the
+        # same way as the stage timings
+        with self._lock:
+            self.queued += 1
+        future = self._pool.submit(
+            self._call, time.perf_counter(), labels, fn, args, kwargs
+        )
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # a job that never started won't decrement the queue itself
+            if future.cancelled():
+                with self._lock:
+                    self.queued -= 1
+            raise
+
+    def stats(self):
+        with self._lock:
+            started = self.completed + self.running
+            return {
+                "workers": self.workers,
+                "threads_per_worker": self.threads_per_worker,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "wait_avg": self.wait_total / started if started else 0.0,
+                "wait_max": self.wait_max,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
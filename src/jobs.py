@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import traceback
+import itertools
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, job_id, kind, priority, params):
+        self.id = job_id
+        self.kind = kind
+        self.priority = priority
+        self.params = params
+        self.status = "queued"
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.segments_done = 0
+        self.segments_total = 0
+        # the process that queued the job and is the only one that can run it
+        self.owner = os.getpid()
+        self.saved_done = 0
+
+    def progress(self, done, total):
+        self.segments_done = done
+        self.segments_total = total
+
+    def eta(self):
+        if self.status != "running" or not self.segments_done:
+            return None
+        elapsed = time.time() - self.started
+        remaining = self.segments_total - self.segments_done
+        return elapsed / self.segments_done * remaining
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "priority": self.priority,
+            "status": self.status,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "segments_done": self.segments_done,
+            "segments_total": self.segments_total,
+            "eta": self.eta(),
+            "owner": self.owner,
+        }
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobManager:
+    def __init__(self, root, workers, max_queue, run_job, ttl=24 * 3600):
+        self.root = root
+        self.workers = workers
+        self.run_job = run_job
+        # finished jobs and their results are deleted this many seconds after
+        # they finish
+        self.ttl = ttl
+        self.queue = asyncio.PriorityQueue(maxsize=max_queue)
+        self.jobs = {}
+        self._seq = itertools.count()
+        self._tasks = []
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, job_id, ext):
+        return os.path.join(self.root, f"{job_id}{ext}")
+
+    def input_path(self, job_id):
+        return self._path(job_id, ".input")
+
+    def result_path(self, job_id):
+        return self._path(job_id, ".wav")
+
+    def _save(self, job):
+        path = self._path(job.id, ".json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(job.to_dict(), f)
+        os.replace(f"{path}.tmp", path)
+
+    def start(self):
+        self._recover()
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+        self._tasks.append(asyncio.create_task(self._expire_loop()))
+        self._tasks.append(asyncio.create_task(self._progress_loop()))
+
+    def _recover(self):
+        # the queue only lives in memory, so jobs a dead process had queued
+        # or was running will never finish; the parameters are not kept on
+        # disk to requeue them, so mark them failed
+        for name in os.listdir(self.root):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                with open(path) as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if job["status"] not in ("queued", "running"):
+                continue
+            owner = job.get("owner")
+            if owner is not None and owner != os.getpid() and _alive(owner):
+                continue
+            job.update(status="failed", error="Interrupted by a restart.")
+            job["finished"] = time.time()
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(job, f)
+            os.replace(f"{path}.tmp", path)
+            input_path = self.input_path(job["id"])
+            if os.path.exists(input_path):
+                os.remove(input_path)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.root):
+            job_id, ext = os.path.splitext(name)
+            if ext != ".json" or job_id in self.jobs:
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                with open(path) as f:
+                    if json.load(f)["status"] not in ("done", "failed"):
+                        continue
+                if os.path.exists(self.result_path(job_id)):
+                    os.remove(self.result_path(job_id))
+                os.remove(path)
+            except (OSError, ValueError):
+                logger.warning(traceback.format_exc())
+
+    async def _progress_loop(self, interval=1.0):
+        # each process runs the jobs it accepted, but under serve.py a status
+        # request may land on any worker, which only sees the json on disk
+        while True:
+            await asyncio.sleep(interval)
+            for job in list(self.jobs.values()):
+                if job.status == "running" and job.segments_done != job.saved_done:
+                    job.saved_done = job.segments_done
+                    self._save(job)
+
+    async def _expire_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await loop.run_in_executor(None, self._expire)
+            await asyncio.sleep(min(self.ttl, 3600))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _write(self, path, data):
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+
+    def _remove(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    async def submit(self, kind, priority, params, data=None):
+        if self.queue.full():
+            raise asyncio.QueueFull
+        job = Job(uuid.uuid4().hex, kind, priority, params)
+        loop = asyncio.get_running_loop()
+        # uploads can be large, write them off the loop and before queueing
+        # so a worker never finds the input missing
+        if data is not None:
+            await loop.run_in_executor(
+                None, self._write, self.input_path(job.id), data
+            )
+        try:
+            # higher priority first, FIFO within the same priority
+            self.queue.put_nowait((-priority, next(self._seq), job))
+        except asyncio.QueueFull:
+            # filled up while the input was written
+            await loop.run_in_executor(None, self._remove, self.input_path(job.id))
+            raise
+        self.jobs[job.id] = job
+        self._save(job)
+        return job
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if not job_id.isalnum():
+            return None
+        # finished jobs from a previous run are only on disk
+        path = self._path(job_id, ".json")
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        return None
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self.queue.get()
+            job.status = "running"
+            job.started = time.time()
+            self._save(job)
+            loop = asyncio.get_running_loop()
+            try:
+                wav = await self.run_job(job)
+                await loop.run_in_executor(
+                    None, self._write, self.result_path(job.id), wav
+                )
+                job.status = "done"
+            except asyncio.CancelledError:
+                self.queue.task_done()
+                raise
+            except Exception as e:
+                logger.warning(traceback.format_exc())
+                job.status = "failed"
+                job.error = getattr(e, "detail", None) or str(e)
+
+            job.finished = time.time()
+            self._save(job)
+            await loop.run_in_executor(None, self._remove, self.input_path(job.id))
+            self.jobs.pop(job.id, None)
+            self.queue.task_done()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queued": self.queue.qsize(),
+            "max_queue": self.queue.maxsize,
+            "running": sum(job.status == "running" for job in self.jobs.values()),
+        }
@@ -0,0 +1,245 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return (
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    )
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    pairs = [f'{k}="{_escape(v)}"' for k, v in pairs]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+                )
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, (counts, total, count) in items:
+            for bound, n in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, [("le", bound)])
+                lines.append(f"{self.name}_bucket{labels} {n}")
+            labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def process_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        # ru_maxrss is the peak in KiB on Linux, the best we have elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def process_memory(pid="self"):
+    # unique vs copy-on-write shared pages, only Linux has smaps_rollup
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                field, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    memory[field] = int(value.split()[0]) * 1024
+    except OSError:
+        return {"rss": process_rss() if pid == "self" else 0}
+    return {
+        "rss": memory.get("Rss", 0),
+        "pss": memory.get("Pss", 0),
+        "shared": memory.get("Shared_Clean", 0) + memory.get("Shared_Dirty", 0),
+        "private": memory.get("Private_Clean", 0) + memory.get("Private_Dirty", 0),
+    }
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "rvc_stage_seconds",
+        "Time spent in each conversion stage.",
+        ("stage", "model", "f0_method", "endpoint"),
+    )
+)
+QUEUE_WAIT_SECONDS = REGISTRY.register(
+    Histogram(
+        "rvc_queue_wait_seconds",
+        "Time conversions wait for an inference worker.",
+        ("model", "f0_method", "endpoint"),
+    )
+)
+CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        "rvc_cache_requests_total",
+        "Cache lookups by cache and result.",
+        ("cache", "result"),
+    )
+)
+CACHE_EVICTIONS = REGISTRY.register(
+    Counter("rvc_cache_evictions_total", "Cache entries evicted.", ("cache",))
+)
+REQUESTS_IN_FLIGHT = REGISTRY.register(
+    Gauge("rvc_requests_in_flight", "Requests being processed.", ("endpoint",))
+)
+REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "rvc_request_seconds",
+        "End to end request latency.",
+        ("endpoint", "status"),
+    )
+)
+PROCESS_RSS = REGISTRY.register(
+    Gauge("rvc_process_resident_memory_bytes", "Resident set size of the process.")
+)
+PROCESS_MEMORY = REGISTRY.register(
+    Gauge(
+        "rvc_process_memory_bytes",
+        "Resident memory of the process split into shared and private pages.",
+        ("state",),
+    )
+)
+EXECUTOR_GAUGE = REGISTRY.register(
+    Gauge("rvc_executor", "Inference executor state.", ("state",))
+)
+MODEL_POOL_GAUGE = REGISTRY.register(
+    Gauge("rvc_model_pool", "Model pool state.", ("state",))
+)
+COALESCED_REQUESTS = REGISTRY.register(
+    Counter(
+        "rvc_coalesced_requests_total",
+        "Requests served by an identical request already in flight.",
+        ("endpoint",),
+    )
+)
+ADMISSION_REQUESTS = REGISTRY.register(
+    Counter(
+        "rvc_admission_requests_total",
+        "Admission decisions by endpoint and result.",
+        ("endpoint", "result"),
+    )
+)
+ADMISSION_GAUGE = REGISTRY.register(
+    Gauge("rvc_admission", "Admission controller state.", ("state",))
+)
+CANCELLED_REQUESTS = REGISTRY.register(
+    Counter(
+        "rvc_cancelled_requests_total",
+        "Conversions stopped early by endpoint and reason.",
+        ("endpoint", "reason"),
+    )
+)
+ENCODE_SECONDS = REGISTRY.register(
+    Histogram(
+        "rvc_encode_seconds",
+        "Time spent encoding output audio by format.",
+        ("format", "endpoint"),
+    )
+)
+MODEL_LOAD_SECONDS = REGISTRY.register(
+    Histogram(
+        "rvc_model_load_seconds",
+        "Voice model load time, cold from .pth or warm from converted weights.",
+        ("kind",),
+    )
+)
@@ -0,0 +1,124 @@
+import numpy as np
+import torch
+from scipy import signal
+
+from src.vc_infer_pipeline import bh, ah
+
+
+class RealtimeSession:
+    # Per-connection state for block-wise conversion. Every block is
+    # converted together with `context` samples of past audio so HuBERT and
+    # F0 see enough history, only the tail is decoded, and consecutive
+    # outputs are joined with an equal-power crossfade.
+    def __init__(
+        self,
+        handle,
+        hubert_model,
+        rmvpe_model,
+        block,
+        context,
+        crossfade,
+        f0_up_key,
+        f0_method,
+        index_rate,
+        protect,
+    ):
+        vc = handle.vc
+        # everything is counted in whole f0/feature frames
+        self.block = max(1, block // vc.window) * vc.window
+        self.context = context // vc.window * vc.window
+        self.crossfade = min(crossfade // vc.window * vc.window, self.block)
+        self.handle = handle
+        self.hubert_model = hubert_model
+        self.rmvpe_model = rmvpe_model
+        self.f0_up_key = f0_up_key
+        self.f0_method = f0_method
+        self.index_rate = index_rate
+        self.protect = protect
+
+        self.upp = handle.tgt_sr // 100
+        self.block_tgt = self.block // vc.window * self.upp
+        self.crossfade_tgt = self.crossfade // vc.window * self.upp
+        self.buffer = np.zeros(
+            self.context + self.crossfade + self.block, dtype=np.float32
+        )
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.remainder = b""
+        self.prev_tail = np.zeros(self.crossfade_tgt, dtype=np.float32)
+        self.fade_in = np.sin(0.5 * np.pi * np.linspace(0, 1, self.crossfade_tgt)) ** 2
+        self.fade_out = 1 - self.fade_in
+        self.sid = torch.tensor([0], device=vc.device).long()
+        self.blocks = 0
+        self.latency_total = 0.0
+
+    def feed(self, data):
+        # float32 PCM may arrive split at any byte offset
+        data = self.remainder + data
+        usable = len(data) // 4 * 4
+        self.remainder = data[usable:]
+        samples = np.frombuffer(data[:usable], dtype=np.float32)
+        self.pending = np.concatenate([self.pending, samples])
+        blocks = []
+        while len(self.pending) >= self.block:
+            blocks.append(self.pending[: self.block])
+            self.pending = self.pending[self.block :]
+        return blocks
+
+    def process(self, block):
+        handle = self.handle
+        vc = handle.vc
+        self.buffer = np.concatenate([self.buffer[self.block :], block])
+        audio = signal.filtfilt(bh, ah, self.buffer)
+        p_len = audio.shape[0] // vc.window
+
+        pitch = pitchf = None
+        if handle.if_f0 == 1:
+            if self.f0_method == "rmvpe":
+                vc.model_rmvpe = self.rmvpe_model
+            # harvest memoizes on the key, every block is new audio
+            key = f"realtime-{id(self)}-{self.blocks}"
+            pitch, pitchf = vc.get_f0(
+                key, audio, p_len, self.f0_up_key, self.f0_method, 3
+            )
+            pitch = torch.tensor(pitch[:p_len], device=vc.device).unsqueeze(0).long()
+            pitchf = (
+                torch.tensor(pitchf[:p_len], device=vc.device).unsqueeze(0).float()
+            )
+
+        times = [0, 0, 0]
+        out = vc.vc(
+            self.hubert_model,
+            handle.net_g,
+            self.sid,
+            audio,
+            pitch,
+            pitchf,
+            times,
+            handle.index,
+            handle.big_npy,
+            self.index_rate,
+            handle.version,
+            self.protect,
+            tail_start=self.context // vc.window,
+        )
+        # HuBERT can come up a frame or two short at the very end, that part
+        # only feeds the fade-out of the saved tail
+        wanted = self.block_tgt + self.crossfade_tgt
+        out = np.pad(out[:wanted], (0, max(0, wanted - len(out))))
+
+        head = out[: self.crossfade_tgt] * self.fade_in + self.prev_tail * self.fade_out
+        emitted = np.concatenate([head, out[self.crossfade_tgt : self.block_tgt]])
+        self.prev_tail = out[self.block_tgt :]
+        self.blocks += 1
+        return np.clip(emitted, -1, 1).astype(np.float32)
+
+    def observe(self, latency):
+        self.latency_total += latency
+
+    def stats(self):
+        return {
+            "blocks": self.blocks,
+            "latency_avg_ms": self.latency_total / self.blocks * 1000
+            if self.blocks
+            else 0.0,
+        }
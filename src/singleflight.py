@@ -0,0 +1,46 @@
+import asyncio
+
+from src.cancel import CancelGroup, CancelToken
+from src.metrics import COALESCED_REQUESTS
+
+
+class SingleFlight:
+    # at most one coroutine runs per key, concurrent callers share its result
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn, cancel=None):
+        # fn gets a CancelGroup that only trips once every caller's token has
+        # been cancelled, a caller without a token keeps the work alive
+        call = self._calls.get(key)
+        if call is None:
+            self.leaders += 1
+            group = CancelGroup()
+            task = asyncio.ensure_future(fn(group))
+            self._calls[key] = task, group
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            task, group = call
+            self.coalesced += 1
+            COALESCED_REQUESTS.inc(endpoint=self.name)
+        group.add(cancel or CancelToken())
+        # the work is shared, so a caller going away must not cancel it
+        # for everyone else still waiting on the same key
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._calls.get(key, (None,))[0] is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # mark the exception as retrieved when every caller is gone
+            task.exception()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,60 @@
+import re
+
+# sentence enders: CJK full-width marks split right away, ASCII ones only
+# before whitespace so "3.14" or "v1.2" stay intact
+_SENTENCE_END = re.compile(r"(?<=[。！？；…\n])|(?<=[.!?;])(?=\s)")
+# weaker breaks used to cut sentences that are still too long
+_CLAUSE_END = re.compile(r"(?<=[，、：,:])")
+
+
+def _cut(text, pattern, max_chars):
+    pieces = []
+    current = ""
+    for part in pattern.split(text):
+        if current and len(current) + len(part) > max_chars:
+            pieces.append(current)
+            current = ""
+        current += part
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_sentences(text, max_chars=200, min_chars=8):
+    sentences = []
+    for sentence in _cut(text, _SENTENCE_END, 1):
+        if len(sentence) <= max_chars:
+            sentences.append(sentence)
+            continue
+        for clause in _cut(sentence, _CLAUSE_END, max_chars):
+            # no punctuation left to break on, fall back to a hard wrap
+            sentences.extend(
+                clause[i : i + max_chars] for i in range(0, len(clause), max_chars)
+            )
+
+    # glue fragments like "Hi." onto the next sentence, tiny edge_tts calls
+    # sound choppy and cost a round trip each
+    merged = []
+    carry = ""
+    for sentence in sentences:
+        if not sentence.strip():
+            carry += sentence
+            continue
+        sentence = carry + sentence
+        carry = ""
+        if len(sentence.strip()) < min_chars:
+            carry = sentence
+        elif (
+            merged
+            and len(merged[-1].strip()) < min_chars
+            and len(merged[-1]) + len(sentence) <= max_chars
+        ):
+            merged[-1] += sentence
+        else:
+            merged.append(sentence)
+    if carry.strip():
+        if merged and len(merged[-1]) + len(carry) <= max_chars:
+            merged[-1] += carry
+        else:
+            merged.append(carry)
+    return [sentence.strip() for sentence in merged]
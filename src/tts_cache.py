@@ -0,0 +1,57 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+
+from src.metrics import CACHE_REQUESTS, CACHE_EVICTIONS
+
+
+class TTSAudioCache:
+    # decoded 16 kHz edge_tts audio, in a memory LRU in front of an AudioCache
+    def __init__(self, disk, max_memory_bytes):
+        self.disk = disk
+        self.max_memory_bytes = max_memory_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+    def make_key(self, text, voice, rate):
+        return self.disk.make_key(text=text, voice=voice, rate=rate)
+
+    def _remember(self, key, audio):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            self._memory[key] = audio
+            self._memory_bytes += audio.nbytes
+            while (
+                self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1
+            ):
+                _, old = self._memory.popitem(last=False)
+                self._memory_bytes -= old.nbytes
+                CACHE_EVICTIONS.inc(cache="edge_tts_memory")
+
+    def get(self, key):
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+        if audio is not None:
+            CACHE_REQUESTS.inc(cache="edge_tts_memory", result="hit")
+            return audio
+        CACHE_REQUESTS.inc(cache="edge_tts_memory", result="miss")
+
+        audio = self.disk.get_array(key)
+        if audio is not None:
+            self._remember(key, audio)
+        return audio
+
+    def put(self, key, audio):
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        self._remember(key, audio)
+        self.disk.put_array(key, audio)
+
+    def stats(self):
+        with self._lock:
+            memory = {"entries": len(self._memory), "bytes": self._memory_bytes}
+        return {"memory": memory, "disk": self.disk.stats()}
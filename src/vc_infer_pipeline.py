@@ -4,7 +4,7 @@ import torch.nn.functional as F
 import scipy.signal as signal
 import pyworld, os, traceback, faiss, librosa, torchcrepe
 from scipy import signal
-from functools import lru_cache
+from functools import lru_cache, partial
 
 now_dir = os.getcwd()
 sys.path.append(now_dir)
@@ -67,6 +67,11 @@ class VC(object):
         self.t_query = self.sr * self.x_query  # 查询切点前后查询时间
         self.t_center = self.sr * self.x_center  # 查询切点位置
         self.t_max = self.sr * self.x_max  # 免查询时长阈值
+        # shorter cuts for streaming so the first chunk arrives sooner
+        self.t_center_stream = self.sr * config.stream_segment
+        self.t_query_stream = min(self.t_query, self.t_center_stream // 4)
+        self.t_max_stream = self.t_center_stream + self.t_query_stream
+        self.limiter_release = 1.25  # max gain recovery per streamed segment
         self.device = config.device
 
     def get_f0(
@@ -104,6 +109,8 @@ class VC(object):
         elif f0_method == "harvest":
             input_audio_path2wav[input_audio_path] = x.astype(np.double)
             f0 = cache_harvest_f0(input_audio_path, self.sr, f0_max, f0_min, 10)
+            # keys are per-input now, don't keep every request's audio around
+            input_audio_path2wav.pop(input_audio_path, None)
             if filter_radius > 2:
                 f0 = signal.medfilt(f0, 3)
         elif f0_method == "crepe":
@@ -161,41 +168,11 @@ class VC(object):
         f0_coarse = np.rint(f0_mel).astype(np.int)
         return f0_coarse, f0bak  # 1-0
 
-    def vc(
-        self,
-        model,
-        net_g,
-        sid,
-        audio0,
-        pitch,
-        pitchf,
-        times,
-        index,
-        big_npy,
-        index_rate,
-        version,
-        protect,
-    ):  # ,file_index,file_big_npy
-        feats = torch.from_numpy(audio0)
-        if self.is_half:
-            feats = feats.half()
-        else:
-            feats = feats.float()
-        if feats.dim() == 2:  # double channels
-            feats = feats.mean(-1)
-        assert feats.dim() == 1, feats.dim()
-        feats = feats.view(1, -1)
-        padding_mask = torch.BoolTensor(feats.shape).to(self.device).fill_(False)
-
-        inputs = {
-            "source": feats.to(self.device),
-            "padding_mask": padding_mask,
-            "output_layer": 9 if version == "v1" else 12,
-        }
-        t0 = ttime()
-        with torch.no_grad():
-            logits = model.extract_features(**inputs)
-            feats = model.final_proj(logits[0]) if version == "v1" else logits[0]
+    def _mix_feats(
+        self, feats, audio_len, pitch, pitchf, index, big_npy, index_rate, protect
+    ):
+        # index retrieval, 2x upsampling and consonant protection on the
+        # HuBERT features of one segment, shared by vc and vc_batch
         if protect < 0.5 and pitch != None and pitchf != None:
             feats0 = feats.clone()
         if (
@@ -227,8 +204,7 @@ class VC(object):
             feats0 = F.interpolate(feats0.permute(0, 2, 1), scale_factor=2).permute(
                 0, 2, 1
             )
-        t1 = ttime()
-        p_len = audio0.shape[0] // self.window
+        p_len = audio_len // self.window
         if feats.shape[1] < p_len:
             p_len = feats.shape[1]
             if pitch != None and pitchf != None:
@@ -242,18 +218,77 @@ class VC(object):
             pitchff = pitchff.unsqueeze(-1)
             feats = feats * pitchff + feats0 * (1 - pitchff)
             feats = feats.to(feats0.dtype)
+        return feats, p_len, pitch, pitchf
+
+    def vc(
+        self,
+        model,
+        net_g,
+        sid,
+        audio0,
+        pitch,
+        pitchf,
+        times,
+        index,
+        big_npy,
+        index_rate,
+        version,
+        protect,
+        tail_start=None,
+        cancel=None,
+    ):  # ,file_index,file_big_npy
+        feats = torch.from_numpy(audio0)
+        if self.is_half:
+            feats = feats.half()
+        else:
+            feats = feats.float()
+        if feats.dim() == 2:  # double channels
+            feats = feats.mean(-1)
+        assert feats.dim() == 1, feats.dim()
+        feats = feats.view(1, -1)
+        padding_mask = torch.BoolTensor(feats.shape).to(self.device).fill_(False)
+
+        inputs = {
+            "source": feats.to(self.device),
+            "padding_mask": padding_mask,
+            "output_layer": 9 if version == "v1" else 12,
+        }
+        t0 = ttime()
+        with torch.no_grad():
+            logits = model.extract_features(**inputs)
+            feats = model.final_proj(logits[0]) if version == "v1" else logits[0]
+        feats, p_len, pitch, pitchf = self._mix_feats(
+            feats,
+            audio0.shape[0],
+            pitch,
+            pitchf,
+            index,
+            big_npy,
+            index_rate,
+            protect,
+        )
+        t1 = ttime()
+        if cancel is not None:
+            cancel.check()
+        # only decode the frames from tail_start on, the rest is context
+        rate = None
+        if tail_start is not None:
+            rate = (p_len - tail_start + 0.5) / p_len
         p_len = torch.tensor([p_len], device=self.device).long()
         with torch.no_grad():
             if pitch != None and pitchf != None:
                 audio1 = (
-                    (net_g.infer(feats, p_len, pitch, pitchf, sid)[0][0, 0])
+                    (net_g.infer(feats, p_len, pitch, pitchf, sid, rate=rate)[0][0, 0])
                     .data.cpu()
                     .float()
                     .numpy()
                 )
             else:
                 audio1 = (
-                    (net_g.infer(feats, p_len, sid)[0][0, 0]).data.cpu().float().numpy()
+                    (net_g.infer(feats, p_len, sid, rate=rate)[0][0, 0])
+                    .data.cpu()
+                    .float()
+                    .numpy()
                 )
         del feats, p_len, padding_mask
         if torch.cuda.is_available():
@@ -263,7 +298,108 @@ class VC(object):
         times[2] += t2 - t1
         return audio1
 
-    def pipeline(
+    def vc_batch(
+        self,
+        model,
+        net_g,
+        sid,
+        items,
+        index,
+        big_npy,
+        index_rate,
+        version,
+        protect,
+    ):
+        # items are (audio0, pitch, pitchf, times) tuples from one or more
+        # requests, converted with a single HuBERT and a single infer call.
+        # The batcher only groups segments from one length bucket; shorter
+        # ones are reflect-padded up to the longest like their own t_pad
+        # edges, since HuBERT's first conv group-norms over the whole input
+        # and zeros would skew it. The extra is masked for the transformer
+        # and its frames are dropped again below.
+        lengths = [item[0].shape[0] for item in items]
+        longest = max(lengths)
+        feats = torch.from_numpy(
+            np.stack(
+                [
+                    np.pad(audio0, (0, longest - len(audio0)), mode="reflect")
+                    for audio0, _, _, _ in items
+                ]
+            )
+        )
+        padding_mask = torch.zeros(len(items), longest, dtype=torch.bool)
+        for i, length in enumerate(lengths):
+            padding_mask[i, length:] = True
+        if self.is_half:
+            feats = feats.half()
+        else:
+            feats = feats.float()
+
+        inputs = {
+            "source": feats.to(self.device),
+            "padding_mask": padding_mask.to(self.device),
+            "output_layer": 9 if version == "v1" else 12,
+        }
+        t0 = ttime()
+        with torch.no_grad():
+            logits = model.extract_features(**inputs)
+            feats = model.final_proj(logits[0]) if version == "v1" else logits[0]
+        frame_mask = logits[1]
+
+        mixed = []
+        for i, (audio0, pitch, pitchf, _) in enumerate(items):
+            n_frames = feats.shape[1]
+            if frame_mask is not None:
+                n_frames = int((~frame_mask[i]).sum())
+            # no more frames than HuBERT gives the segment on its own, a 400
+            # sample receptive field at a 320 sample stride
+            n_frames = min(n_frames, (lengths[i] - 80) // 320)
+            mixed.append(
+                self._mix_feats(
+                    feats[i : i + 1, :n_frames],
+                    lengths[i],
+                    pitch,
+                    pitchf,
+                    index,
+                    big_npy,
+                    index_rate,
+                    protect,
+                )
+            )
+        t1 = ttime()
+
+        p_lens = [m[1] for m in mixed]
+        max_len = max(p_lens)
+        phone = torch.zeros(
+            len(items), max_len, feats.shape[-1], dtype=mixed[0][0].dtype
+        ).to(self.device)
+        for i, (f, p_len, _, _) in enumerate(mixed):
+            phone[i, :p_len] = f[0, :p_len]
+        phone_lengths = torch.tensor(p_lens, device=self.device).long()
+        sids = sid.repeat(len(items))
+        with torch.no_grad():
+            if mixed[0][2] != None and mixed[0][3] != None:
+                pitch = torch.zeros(len(items), max_len, device=self.device).long()
+                pitchf = torch.zeros(len(items), max_len, device=self.device)
+                for i, (_, p_len, p, pf) in enumerate(mixed):
+                    pitch[i, :p_len] = p[0, :p_len]
+                    pitchf[i, :p_len] = pf[0, :p_len]
+                o = net_g.infer(phone, phone_lengths, pitch, pitchf, sids)[0]
+            else:
+                o = net_g.infer(phone, phone_lengths, sids)[0]
+        upp = o.shape[-1] // max_len
+        audio1 = o[:, 0].data.cpu().float().numpy()
+        outs = [audio1[i, : p_lens[i] * upp] for i in range(len(items))]
+        del feats, phone, phone_lengths, padding_mask
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        t2 = ttime()
+        for _, _, _, times in items:
+            times[0] += t1 - t0
+            times[2] += t2 - t1
+        return outs
+
+    def _segments(
         self,
         model,
         net_g,
@@ -274,18 +410,32 @@ class VC(object):
         f0_up_key,
         f0_method,
         file_index,
-        # file_big_npy,
         index_rate,
         if_f0,
         filter_radius,
-        tgt_sr,
-        resample_sr,
-        rms_mix_rate,
         version,
         protect,
         f0_file=None,
+        t_center=None,
+        t_query=None,
+        t_max=None,
+        batcher=None,
+        index=None,
+        big_npy=None,
+        progress=None,
+        cancel=None,
     ):
-        if (
+        # yields (filtered input slice, converted output) per opt_ts segment
+        t_center = t_center or self.t_center
+        t_query = t_query or self.t_query
+        t_max = t_max or self.t_max
+        if cancel is not None:
+            # the request may have given up while it was queued
+            cancel.check()
+        if index is not None:
+            # already read when the model was loaded
+            pass
+        elif (
             file_index != ""
             # and file_big_npy != ""
             # and os.path.exists(file_big_npy) == True
@@ -304,22 +454,20 @@ class VC(object):
         audio = signal.filtfilt(bh, ah, audio)
         audio_pad = np.pad(audio, (self.window // 2, self.window // 2), mode="reflect")
         opt_ts = []
-        if audio_pad.shape[0] > self.t_max:
+        if audio_pad.shape[0] > t_max:
             audio_sum = np.zeros_like(audio)
             for i in range(self.window):
                 audio_sum += audio_pad[i : i - self.window]
-            for t in range(self.t_center, audio.shape[0], self.t_center):
+            for t in range(t_center, audio.shape[0], t_center):
                 opt_ts.append(
                     t
-                    - self.t_query
+                    - t_query
                     + np.where(
-                        np.abs(audio_sum[t - self.t_query : t + self.t_query])
-                        == np.abs(audio_sum[t - self.t_query : t + self.t_query]).min()
+                        np.abs(audio_sum[t - t_query : t + t_query])
+                        == np.abs(audio_sum[t - t_query : t + t_query]).min()
                     )[0][0]
                 )
         s = 0
-        audio_opt = []
-        t = None
         t1 = ttime()
         audio_pad = np.pad(audio, (self.t_pad, self.t_pad), mode="reflect")
         p_len = audio_pad.shape[0] // self.window
@@ -354,77 +502,143 @@ class VC(object):
             pitchf = torch.tensor(pitchf, device=self.device).unsqueeze(0).float()
         t2 = ttime()
         times[1] += t2 - t1
-        for t in opt_ts:
-            t = t // self.window * self.window
-            if if_f0 == 1:
-                audio_opt.append(
-                    self.vc(
-                        model,
-                        net_g,
-                        sid,
-                        audio_pad[s : t + self.t_pad2 + self.window],
-                        pitch[:, s // self.window : (t + self.t_pad2) // self.window],
-                        pitchf[:, s // self.window : (t + self.t_pad2) // self.window],
-                        times,
-                        index,
-                        big_npy,
-                        index_rate,
-                        version,
-                        protect,
-                    )[self.t_pad_tgt : -self.t_pad_tgt]
-                )
+        if cancel is not None:
+            cancel.check()
+        segments = []
+        for t in opt_ts + [None]:
+            if t is None:
+                audio0 = audio_pad[s:]
+                seg_pitch = slice(s // self.window, None)
             else:
-                audio_opt.append(
-                    self.vc(
+                t = t // self.window * self.window
+                audio0 = audio_pad[s : t + self.t_pad2 + self.window]
+                seg_pitch = slice(s // self.window, (t + self.t_pad2) // self.window)
+            segments.append(
+                (
+                    audio[s:t],
+                    audio0,
+                    pitch[:, seg_pitch] if if_f0 == 1 else None,
+                    pitchf[:, seg_pitch] if if_f0 == 1 else None,
+                )
+            )
+            s = t
+
+        if batcher is None:
+
+            def convert():
+                for _, audio0, seg_pitch, seg_pitchf in segments:
+                    if cancel is not None:
+                        cancel.check()
+                    yield self.vc(
                         model,
                         net_g,
                         sid,
-                        audio_pad[s : t + self.t_pad2 + self.window],
-                        None,
-                        None,
+                        audio0,
+                        seg_pitch,
+                        seg_pitchf,
                         times,
                         index,
                         big_npy,
                         index_rate,
                         version,
                         protect,
-                    )[self.t_pad_tgt : -self.t_pad_tgt]
-                )
-            s = t
-        if if_f0 == 1:
-            audio_opt.append(
-                self.vc(
-                    model,
-                    net_g,
-                    sid,
-                    audio_pad[t:],
-                    pitch[:, t // self.window :] if t is not None else pitch,
-                    pitchf[:, t // self.window :] if t is not None else pitchf,
-                    times,
-                    index,
-                    big_npy,
-                    index_rate,
-                    version,
-                    protect,
-                )[self.t_pad_tgt : -self.t_pad_tgt]
-            )
+                        cancel=cancel,
+                    )
+
+            outputs = convert()
         else:
-            audio_opt.append(
-                self.vc(
-                    model,
-                    net_g,
-                    sid,
-                    audio_pad[t:],
-                    None,
-                    None,
-                    times,
-                    index,
-                    big_npy,
-                    index_rate,
-                    version,
-                    protect,
-                )[self.t_pad_tgt : -self.t_pad_tgt]
+            # hand every segment to the batcher up front, it may group them
+            # with each other and with segments from concurrent requests
+            key = (id(model), id(net_g), file_index, index_rate, version, protect)
+            run_batch = partial(
+                self.vc_batch,
+                model,
+                net_g,
+                sid,
+                index=index,
+                big_npy=big_npy,
+                index_rate=index_rate,
+                version=version,
+                protect=protect,
             )
+            futures = [
+                batcher.submit(key, run_batch, (audio0, seg_pitch, seg_pitchf, times))
+                for _, audio0, seg_pitch, seg_pitchf in segments
+            ]
+            outputs = self._results(futures, cancel)
+
+        for i, ((seg_in, _, _, _), audio1) in enumerate(zip(segments, outputs)):
+            if progress is not None:
+                progress(i + 1, len(segments))
+            yield seg_in, audio1[self.t_pad_tgt : -self.t_pad_tgt]
+        del pitch, pitchf, sid
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def _results(self, futures, cancel):
+        try:
+            for future in futures:
+                if cancel is not None:
+                    cancel.check()
+                yield future.result()
+        finally:
+            # drop whatever the batcher has not started yet
+            for future in futures:
+                future.cancel()
+
+    def pipeline(
+        self,
+        model,
+        net_g,
+        sid,
+        audio,
+        input_audio_path,
+        times,
+        f0_up_key,
+        f0_method,
+        file_index,
+        # file_big_npy,
+        index_rate,
+        if_f0,
+        filter_radius,
+        tgt_sr,
+        resample_sr,
+        rms_mix_rate,
+        version,
+        protect,
+        f0_file=None,
+        batcher=None,
+        index=None,
+        big_npy=None,
+        progress=None,
+        cancel=None,
+    ):
+        audio_in, audio_opt = [], []
+        for seg_in, seg_opt in self._segments(
+            model,
+            net_g,
+            sid,
+            audio,
+            input_audio_path,
+            times,
+            f0_up_key,
+            f0_method,
+            file_index,
+            index_rate,
+            if_f0,
+            filter_radius,
+            version,
+            protect,
+            f0_file,
+            batcher=batcher,
+            index=index,
+            big_npy=big_npy,
+            progress=progress,
+            cancel=cancel,
+        ):
+            audio_in.append(seg_in)
+            audio_opt.append(seg_opt)
+        audio = np.concatenate(audio_in)
         audio_opt = np.concatenate(audio_opt)
         if rms_mix_rate != 1:
             audio_opt = change_rms(audio, 16000, audio_opt, tgt_sr, rms_mix_rate)
@@ -437,7 +651,83 @@ class VC(object):
         if audio_max > 1:
             max_int16 /= audio_max
         audio_opt = (audio_opt * max_int16).astype(np.int16)
-        del pitch, pitchf, sid
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
         return audio_opt
+
+    def pipeline_stream(
+        self,
+        model,
+        net_g,
+        sid,
+        audio,
+        input_audio_path,
+        times,
+        f0_up_key,
+        f0_method,
+        file_index,
+        index_rate,
+        if_f0,
+        filter_radius,
+        tgt_sr,
+        resample_sr,
+        rms_mix_rate,
+        version,
+        protect,
+        f0_file=None,
+        batcher=None,
+        index=None,
+        big_npy=None,
+        progress=None,
+        cancel=None,
+        limiter=None,
+    ):
+        # Same as pipeline, but yields int16 chunks as each segment is done.
+        # Segments are cut shorter and the global peak normalization is
+        # replaced by a limiter that only knows the audio emitted so far.
+        # limiter is a one-item list holding the gain, pass the same one to
+        # consecutive calls that make up one stream.
+        if limiter is None:
+            limiter = [1.0]
+        gain = limiter[0]
+        for seg_in, seg_opt in self._segments(
+            model,
+            net_g,
+            sid,
+            audio,
+            input_audio_path,
+            times,
+            f0_up_key,
+            f0_method,
+            file_index,
+            index_rate,
+            if_f0,
+            filter_radius,
+            version,
+            protect,
+            f0_file,
+            t_center=self.t_center_stream,
+            t_query=self.t_query_stream,
+            t_max=self.t_max_stream,
+            batcher=batcher,
+            index=index,
+            big_npy=big_npy,
+            progress=progress,
+            cancel=cancel,
+        ):
+            if rms_mix_rate != 1 and len(seg_in) > 0:
+                seg_opt = change_rms(seg_in, 16000, seg_opt, tgt_sr, rms_mix_rate)
+            if resample_sr >= 16000 and tgt_sr != resample_sr:
+                seg_opt = librosa.resample(
+                    seg_opt, orig_sr=tgt_sr, target_sr=resample_sr
+                )
+            peak = np.abs(seg_opt).max() if len(seg_opt) else 0
+            target = min(1.0, gain * self.limiter_release)
+            if peak * target > 0.99:
+                target = 0.99 / peak
+            if target < gain:
+                # attack immediately, the whole segment is our look-ahead
+                env = target
+            else:
+                env = np.linspace(gain, target, len(seg_opt), dtype=np.float32)
+            gain = limiter[0] = target
+            seg_opt = np.clip(seg_opt * env * 32768, -32768, 32767)
+            yield seg_opt.astype(np.int16)
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+# the modules live at the repository root, not in an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def tiny_config():
+    # a v1 f0 synthesizer small enough to build in a test
+    return [17, 32, 16, 16, 32, 2, 2, 3, 0, "1", [3], [[1, 3, 5]], [4, 4], 32, [8, 8], 2, 16, 40000]
+
+
+@pytest.fixture
+def tiny_synthesizer(tiny_config):
+    torch = pytest.importorskip("torch")
+    from lib.infer_pack.models import SynthesizerTrnMs256NSFsid
+
+    torch.manual_seed(0)
+    net_g = SynthesizerTrnMs256NSFsid(*tiny_config, is_half=False)
+    del net_g.enc_q
+    return net_g.eval()
+
+
+@pytest.fixture
+def tiny_model(tmp_path, monkeypatch, tiny_config, tiny_synthesizer):
+    # the tiny synthesizer saved as weights/tiny/tiny.pth, run from tmp_path
+    torch = pytest.importorskip("torch")
+    model_dir = tmp_path / "weights" / "tiny"
+    model_dir.mkdir(parents=True)
+    torch.save(
+        {
+            "weight": tiny_synthesizer.state_dict(),
+            "config": list(tiny_config),
+            "f0": 1,
+            "version": "v1",
+        },
+        model_dir / "tiny.pth",
+    )
+    monkeypatch.chdir(tmp_path)
+    return model_dir, tiny_synthesizer
@@ -0,0 +1,20 @@
+import io
+
+import pytest
+
+np = pytest.importorskip("numpy")
+sf = pytest.importorskip("soundfile")
+audio_io = pytest.importorskip("src.audio_io")
+
+
+@pytest.mark.parametrize("fmt", audio_io.AVAILABLE_FORMATS)
+def test_encode_40k_clip(fmt):
+    # 40 kHz is what most RVC models put out, opus and mp3 cannot take it
+    t = np.arange(40000) / 40000
+    clip = (np.sin(2 * np.pi * 440 * t) * 16000).astype(np.int16)
+    for data in (
+        audio_io.encode_audio(clip, 40000, fmt),
+        audio_io.transcode_wav(audio_io.encode_audio(clip, 40000, "wav"), fmt),
+    ):
+        audio, sr = sf.read(io.BytesIO(data))
+        assert abs(len(audio) / sr - 1.0) < 0.1
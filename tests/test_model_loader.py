@@ -0,0 +1,28 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+model_loader = pytest.importorskip("model_loader")
+
+
+def test_cold_then_warm_load(tiny_model):
+    model_dir, net_g = tiny_model
+    expected = model_loader._probe(net_g, 1)
+    loader = model_loader.ModelLoader()
+    loader.config.is_half = False
+    loader.config.device = "cpu"
+
+    cold = loader.build("tiny")
+    assert cold.load_kind == "cold"
+    assert list(model_dir.glob("tiny.fp32.safetensors"))
+
+    warm = loader.build("tiny")
+    assert warm.load_kind == "warm"
+    # everything built on the meta device was replaced by the cached weights
+    assert not any(t.is_meta for t in warm.net_g.state_dict().values())
+
+    tolerance = 1e-4 * expected.abs().max().item()
+    for handle in (cold, warm):
+        # nothing left to fold, and the output matches the unfolded model
+        assert model_loader.fold_weight_norm(handle.net_g) == 0
+        out = model_loader._probe(handle.net_g, 1)
+        assert (out - expected).abs().max().item() <= tolerance